@@ -0,0 +1,61 @@
+from urllib.parse import urlsplit
+import asyncio
+import json
+
+
+class HTTPConnection:
+    def __init__(self, url: str) -> None:
+        parts = urlsplit(url)
+        self.host: str = parts.hostname
+        self.port: int = parts.port or 80
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: dict | None = None,
+        headers: dict | None = None
+    ) -> tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        content: bytes = json.dumps(body).encode() if body is not None else b''
+        lines: list[str] = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            f'Content-Length: {len(content)}',
+            'Content-Type: application/json'
+        ]
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        self._writer.write(('\r\n'.join(lines)+'\r\n\r\n').encode()+content)
+        await self._writer.drain()
+        try:
+            return await self._read_response()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.close()
+            raise
+
+    async def _read_response(self) -> tuple[int, bytes]:
+        status_line: bytes = await self._reader.readuntil(b'\r\n')
+        status_code: int = int(status_line.split()[1])
+        response_headers: dict[str, str] = {}
+        while (line:= await self._reader.readuntil(b'\r\n')) != b'\r\n':
+            name, _, value = line.decode().partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding') == 'chunked':
+            body: bytes = b''
+            while (size:= int((await self._reader.readuntil(b'\r\n')).strip(), 16)):
+                body += await self._reader.readexactly(size)
+                await self._reader.readexactly(2)
+            await self._reader.readexactly(2)
+        else:
+            body = await self._reader.readexactly(int(response_headers.get('content-length', 0)))
+        if response_headers.get('connection') == 'close':
+            await self.close()
+        return status_code, body
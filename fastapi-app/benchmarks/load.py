@@ -0,0 +1,171 @@
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+
+from benchmarks.http import HTTPConnection
+from benchmarks.seed import PASSWORD, bench_login, seed_users
+from benchmarks.stats import Recorder
+from config.settings import Settings, get_settings
+
+
+SCENARIOS: tuple[str, ...] = ("login", "salary", "refresh")
+APP_DIR: Path = Path(__file__).resolve().parent.parent
+
+
+def parse_args() -> Namespace:
+    parser: ArgumentParser = ArgumentParser(description="Load test /user/login, /user/salary/get and /token/refresh/")
+    parser.add_argument("--url", help="benchmark a running server instead of starting main:app")
+    parser.add_argument("--users", type=int, default=1000, help="number of seeded users")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--no-seed", action="store_true")
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    return parser.parse_args()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    connection: HTTPConnection = HTTPConnection(url)
+    deadline: float = perf_counter()+timeout
+    while True:
+        try:
+            await connection.request("GET", "/openapi.json")
+            await connection.close()
+            return
+        except OSError:
+            if perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def issue_tokens(url: str, logins: list[str], concurrency: int) -> dict[str, dict]:
+    tokens: dict[str, dict] = {}
+    pending = iter(logins)
+
+    async def worker() -> None:
+        connection: HTTPConnection = HTTPConnection(url)
+        for login in pending:
+            status_code, body = await connection.request("POST", "/user/login", { 'login': login, 'password': PASSWORD })
+            if status_code == 200:
+                tokens[login] = json.loads(body)
+        await connection.close()
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return tokens
+
+def scenario_request(scenario: str, login: str, tokens: dict[str, dict]) -> tuple[str, str, dict | None, dict]:
+    if scenario == "login":
+        return "POST", "/user/login", { 'login': login, 'password': PASSWORD }, {}
+    if scenario == "salary":
+        return "GET", "/user/salary/get", None, { 'Authorization': f'Bearer {tokens[login]["access_token"]}' }
+    return "POST", "/token/refresh/", None, { 'Authorization': f'Bearer {tokens[login]["refresh_token"]}' }
+
+async def run_scenario(
+    url: str,
+    scenario: str,
+    logins: list[str],
+    tokens: dict[str, dict],
+    concurrency: int,
+    duration: float
+) -> dict:
+    recorder: Recorder = Recorder(scenario)
+    users = itertools.cycle(logins if scenario == "login" else list(tokens))
+    started: float = perf_counter()
+    deadline: float = started+duration
+
+    async def worker() -> None:
+        connection: HTTPConnection = HTTPConnection(url)
+        while perf_counter() < deadline:
+            method, path, body, headers = scenario_request(scenario, next(users), tokens)
+            request_started: float = perf_counter()
+            try:
+                status_code, _ = await connection.request(method, path, body, headers)
+            except (OSError, asyncio.IncompleteReadError):
+                status_code = None
+            recorder.record(perf_counter()-request_started, status_code)
+        await connection.close()
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return recorder.summary(perf_counter()-started)
+
+async def main(args: Namespace) -> dict:
+    settings: Settings = get_settings()
+    scenarios: list[str] = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {SCENARIOS!r}")
+
+    if args.no_seed:
+        logins: list[str] = [bench_login(number) for number in range(args.users)]
+    else:
+        settings.database.connect(settings.pool_options)
+        try:
+            logins = await seed_users(settings.database, args.users)
+        finally:
+            await settings.database.disconnect()
+
+    server: subprocess.Popen | None = None
+    url: str = args.url
+    if url is None:
+        port: int = free_port()
+        url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--workers", str(args.server_workers), "--log-level", "warning"],
+            cwd=APP_DIR,
+            # every request comes from one address over a few logins, the rate limits would answer 429
+            env={ **os.environ, 'LOGIN_RATE_PER_IP': "0", 'LOGIN_RATE_PER_LOGIN': "0" }
+        )
+    try:
+        await wait_ready(url)
+        tokens: dict[str, dict] = {}
+        if {"salary", "refresh"} & set(scenarios):
+            tokens = await issue_tokens(url, logins[:max(args.concurrency*4, 1)], args.concurrency)
+            if not tokens:
+                raise SystemExit("Could not log in any seeded user")
+        results: list[dict] = [
+            await run_scenario(url, name, logins, tokens, args.concurrency, args.duration) for name in scenarios
+        ]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    return {
+        'started_at': datetime.now().isoformat(),
+        'config': {
+            'url': url,
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'server_workers': args.server_workers
+        },
+        'scenarios': results
+    }
+
+if __name__ == "__main__":
+    arguments: Namespace = parse_args()
+    report: dict = asyncio.run(main(arguments))
+    arguments.output.write_text(json.dumps(report, indent=2))
+    for result in report['scenarios']:
+        latency: dict = result['latency_ms']
+        print(
+            f"{result['name']:>8}: {result['throughput_rps']:9.1f} req/s  "
+            f"p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+            f"errors {result['error_rate']:.2%}  throttled {result['throttled_rate']:.2%}"
+        )
+    # throttled requests never reach the handlers, their timings would skew the run
+    if any(result['throttled'] for result in report['scenarios']):
+        raise SystemExit("Requests were rate limited (429), disable LOGIN_RATE_PER_IP and LOGIN_RATE_PER_LOGIN on the server")
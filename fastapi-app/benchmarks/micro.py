@@ -0,0 +1,88 @@
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+import json
+
+from fastapi.responses import JSONResponse
+from fastapi._compat import ModelField
+from fastapi.utils import create_model_field
+
+from benchmarks.stats import Recorder
+from src.handlers.password import hash_password, verify_password
+from src.handlers.token import create_access_token, decode_jwt, decode_jwt_cached, encode_jwt, get_key_manager
+from src.responses import FastJSONResponse, MsgPackResponse, msgpack
+from src.schemas import UserSalary
+
+
+SALARY_FIELD: ModelField = create_model_field(name="Response_user_salary_get", type_=UserSalary, mode="serialization")
+
+
+def parse_args() -> Namespace:
+    parser: ArgumentParser = ArgumentParser(description="Micro-benchmarks for password hashing, JWT handling and response rendering")
+    parser.add_argument("--iterations", type=int, default=1000, help="iterations for JWT and response rendering benchmarks")
+    parser.add_argument("--password-iterations", type=int, default=20, help="iterations for bcrypt benchmarks")
+    parser.add_argument("--output", type=Path, default=Path("bench_micro.json"))
+    return parser.parse_args()
+
+def measure(name: str, func: Callable[[], object], iterations: int) -> dict:
+    func()
+    recorder: Recorder = Recorder(name)
+    started: float = perf_counter()
+    for _ in range(iterations):
+        call_started: float = perf_counter()
+        func()
+        recorder.record(perf_counter()-call_started, 200)
+    return recorder.summary(perf_counter()-started)
+
+def response_model_render(row: dict) -> bytes:
+    # what FastAPI does for /user/salary/get with response_model=UserSalary and the default JSONResponse
+    value, _ = SALARY_FIELD.validate(row, {}, loc=("response",))
+    return JSONResponse(SALARY_FIELD.serialize(value, exclude_unset=True)).body
+
+def salary_benchmarks(iterations: int) -> list[dict]:
+    row: dict = {
+        'employee_id': '3f0c1b8e-5a7d-4c1e-9b2a-1d6f0e4c7a90',
+        'user_id': '8b2e4d6f-1a3c-4e5b-9d7f-2c4a6e8b0d13',
+        'salary': 100000,
+        'next_raise_date': datetime(2026, 1, 1, 12, 0)
+    }
+    results: list[dict] = [
+        measure("salary_response_model", lambda: response_model_render(row), iterations),
+        measure("salary_fast_json", lambda: FastJSONResponse(row).body, iterations)
+    ]
+    if msgpack is not None:
+        results.append(measure("salary_msgpack", lambda: MsgPackResponse(row).body, iterations))
+    return results
+
+def main(args: Namespace) -> dict:
+    hashed: bytes = hash_password("bench-password")
+    user: dict = { 'user_id': 'bench', 'login': 'bench' }
+    token: str = create_access_token(user)
+    payload: dict = { 'sub': 'bench', 'user_id': 'bench', 'login': 'bench' }
+    results: list[dict] = [
+        measure("hash_password", lambda: hash_password("bench-password"), args.password_iterations),
+        measure("verify_password", lambda: verify_password("bench-password", hashed), args.password_iterations),
+        measure("encode_jwt", lambda: encode_jwt(payload), args.iterations),
+        measure("decode_jwt", lambda: decode_jwt(token), args.iterations),
+        measure("decode_jwt_cached", lambda: decode_jwt_cached(token), args.iterations),
+        *salary_benchmarks(args.iterations)
+    ]
+    return {
+        'started_at': datetime.now().isoformat(),
+        'config': {
+            'algorithm': get_key_manager().signing_key.algorithm,
+            'iterations': args.iterations,
+            'password_iterations': args.password_iterations
+        },
+        'benchmarks': results
+    }
+
+if __name__ == "__main__":
+    arguments: Namespace = parse_args()
+    report: dict = main(arguments)
+    arguments.output.write_text(json.dumps(report, indent=2))
+    for result in report['benchmarks']:
+        latency: dict = result['latency_ms']
+        print(f"{result['name']:>21}: mean {latency['mean']:9.3f} ms  p99 {latency['p99']:9.3f} ms")
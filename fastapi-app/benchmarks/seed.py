@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import Result, Select, insert, select
+
+from config.database import DataBaseServer
+from src.handlers.password import hash_password
+from src.models import Employees, Users
+
+
+LOGIN_PREFIX: str = "bench_"
+PASSWORD: str = "bench-password"
+CHUNK_SIZE: int = 1000
+
+
+def bench_login(number: int) -> str:
+    return f'{LOGIN_PREFIX}{number}'
+
+async def seed_users(database: DataBaseServer, count: int) -> list[str]:
+    logins: list[str] = [bench_login(number) for number in range(count)]
+    async with database.session_maker() as session:
+        query: Select = select(Users.login).where(Users.login.startswith(LOGIN_PREFIX))
+        result: Result = await session.execute(query)
+        existing: set[str] = set(result.scalars().all())
+    missing: list[str] = [login for login in logins if login not in existing]
+    # one bcrypt hash for every seeded user, hashing each of them would dominate the setup
+    hashed_password: str = hash_password(PASSWORD).decode()
+    next_raise_date: datetime = datetime.now()+timedelta(days=180)
+    for start in range(0, len(missing), CHUNK_SIZE):
+        employees: list[dict] = []
+        users: list[dict] = []
+        for login in missing[start:start+CHUNK_SIZE]:
+            employee_id = uuid4()
+            employees.append({
+                'id': employee_id, 'full_name': f'Bench {login}', 'salary': 100000, 'next_raise_date': next_raise_date
+            })
+            users.append({ 'id': uuid4(), 'login': login, 'password': hashed_password, 'employee_id': employee_id })
+        async with database.session_maker() as session:
+            async with session.begin():
+                await session.execute(insert(Employees).values(employees))
+                await session.execute(insert(Users).values(users))
+    return logins
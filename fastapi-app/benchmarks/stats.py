@@ -0,0 +1,48 @@
+from dataclasses import dataclass, field
+import math
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered: list[float] = sorted(values)
+    rank: int = max(1, math.ceil(percent/100*len(ordered)))
+    return ordered[rank-1]
+
+
+@dataclass
+class Recorder:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    throttled: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+
+    def record(self, seconds: float, status_code: int | None) -> None:
+        self.latencies.append(seconds)
+        if status_code is not None:
+            self.statuses[status_code] = self.statuses.get(status_code, 0)+1
+        if status_code is None or status_code >= 400:
+            self.errors += 1
+        if status_code == 429:
+            self.throttled += 1
+
+    def summary(self, elapsed: float) -> dict:
+        requests: int = len(self.latencies)
+        return {
+            'name': self.name,
+            'requests': requests,
+            'errors': self.errors,
+            'error_rate': self.errors/requests if requests else 0.0,
+            'throttled': self.throttled,
+            'throttled_rate': self.throttled/requests if requests else 0.0,
+            'throughput_rps': requests/elapsed if elapsed else 0.0,
+            'latency_ms': {
+                'mean': sum(self.latencies)/requests*1000 if requests else 0.0,
+                'p50': percentile(self.latencies, 50)*1000,
+                'p95': percentile(self.latencies, 95)*1000,
+                'p99': percentile(self.latencies, 99)*1000,
+                'max': max(self.latencies, default=0.0)*1000
+            },
+            'statuses': { str(code): count for code, count in sorted(self.statuses.items()) }
+        }
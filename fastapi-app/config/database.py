@@ -1,9 +1,27 @@
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import AsyncGenerator
+from itertools import count
+from time import time
+from typing import AsyncGenerator, AsyncIterator
+import asyncio
 
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy import TextClause, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.asyncio.engine import AsyncEngine
+from sqlalchemy.pool import QueuePool
+
+ENGINE_NOT_STARTED: str = "Database engine is not started, call connect() on application startup"
+# replay lag only counts while the replica has received WAL it has not applied yet,
+# an idle primary would otherwise make every replica look stale
+REPLICA_LAG: TextClause = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+TRY_ADVISORY_LOCK: TextClause = text("SELECT pg_try_advisory_lock(hashtext(:name))")
+ADVISORY_UNLOCK: TextClause = text("SELECT pg_advisory_unlock(hashtext(:name))")
 
 @dataclass
 class Server:
@@ -19,21 +37,195 @@ class Server:
         self.password = args[3]
 
 
+@dataclass
+class PoolOptions:
+    pool_size: int
+    max_overflow: int
+    pool_pre_ping: bool
+    pool_recycle: int
+    statement_cache_size: int
+
+
+@dataclass
+class Replica:
+    url: str
+    engine: AsyncEngine
+    session_maker: async_sessionmaker[AsyncSession]
+    healthy: bool = True
+    lag: float = 0.0
+    checked_at: float | None = None
+    error: str | None = None
+    reads: int = 0
+
+    def status(self) -> dict:
+        return {
+            'host': self.engine.url.host,
+            'port': self.engine.url.port,
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'checked_at': self.checked_at,
+            'error': self.error,
+            'reads': self.reads
+        }
+
+
 @dataclass
 class DataBaseServer(Server):
     name: str
     _url_async: str
+    _replica_urls: list[str]
+    _engine: AsyncEngine | None
+    _session_maker: async_sessionmaker[AsyncSession] | None
+    _replicas: list[Replica]
 
     def __init__(self, *args) -> None:
         super().__init__(args[0], args[1], args[2], args[3])
         self.name = args[4]
         self._url_async = f"postgresql+asyncpg://{self.username}:{self.password}@{self.host}:{self.port}/{self.name}"
+        self._replica_urls = list(args[5]) if len(args) > 5 else []
+        self._engine = None
+        self._session_maker = None
+        self._replicas = []
+        self._next_replica = count()
+        self._health_task: asyncio.Task | None = None
+        self.primary_reads = 0
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            raise RuntimeError(ENGINE_NOT_STARTED)
+        return self._engine
+
+    @property
+    def session_maker(self) -> async_sessionmaker[AsyncSession]:
+        if self._session_maker is None:
+            raise RuntimeError(ENGINE_NOT_STARTED)
+        return self._session_maker
+
+    @property
+    def replica_engines(self) -> list[AsyncEngine]:
+        return [replica.engine for replica in self._replicas]
+
+    @staticmethod
+    def _create_engine(url: str, options: PoolOptions) -> AsyncEngine:
+        return create_async_engine(
+            url,
+            pool_size=options.pool_size,
+            max_overflow=options.max_overflow,
+            pool_pre_ping=options.pool_pre_ping,
+            pool_recycle=options.pool_recycle,
+            connect_args={ 'statement_cache_size': options.statement_cache_size }
+        )
+
+    def connect(self, options: PoolOptions) -> AsyncEngine:
+        if self._engine is None:
+            self._engine = self._create_engine(self._url_async, options)
+            self._session_maker = async_sessionmaker(self._engine, class_=AsyncSession, expire_on_commit=False)
+            for url in self._replica_urls:
+                engine: AsyncEngine = self._create_engine(url, options)
+                self._replicas.append(Replica(
+                    url=url,
+                    engine=engine,
+                    session_maker=async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                ))
+        return self._engine
+
+    async def disconnect(self) -> None:
+        await self.stop_health_checks()
+        for replica in self._replicas:
+            await replica.engine.dispose()
+        self._replicas = []
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+            self._session_maker = None
+
+    # yields whether this process got the lock, the connection is held until the block ends
+    @asynccontextmanager
+    async def advisory_lock(self, name: str) -> AsyncIterator[bool]:
+        async with self.engine.connect() as connection:
+            connection: AsyncConnection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+            locked: bool = bool(await connection.scalar(TRY_ADVISORY_LOCK, { 'name': name }))
+            try:
+                yield locked
+            finally:
+                if locked:
+                    try:
+                        await connection.execute(ADVISORY_UNLOCK, { 'name': name })
+                    except BaseException:
+                        # the pool keeps connections open, one that may still hold the lock is closed instead
+                        await connection.invalidate()
+                        raise
+
+    def start_health_checks(self, interval: float, max_lag: float) -> None:
+        if self._replicas and self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_replicas(interval, max_lag))
+
+    async def stop_health_checks(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    async def _check_replicas(self, interval: float, max_lag: float) -> None:
+        while True:
+            await asyncio.gather(*[self.check_replica(replica, interval, max_lag) for replica in self._replicas])
+            await asyncio.sleep(interval)
+
+    async def _replica_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as connection:
+            return float(await connection.scalar(REPLICA_LAG))
+
+    async def check_replica(self, replica: Replica, timeout: float, max_lag: float) -> bool:
+        try:
+            replica.lag = await asyncio.wait_for(self._replica_lag(replica), timeout)
+            replica.error = None if replica.lag <= max_lag else f'Replication lag {replica.lag:.1f}s exceeds {max_lag}s'
+        except (SQLAlchemyError, OSError, asyncio.TimeoutError) as err:
+            replica.error = str(err) or type(err).__name__
+        replica.healthy = replica.error is None
+        replica.checked_at = time()
+        return replica.healthy
+
+    def read_session_maker(self) -> async_sessionmaker[AsyncSession]:
+        healthy: list[Replica] = [replica for replica in self._replicas if replica.healthy]
+        if not healthy:
+            self.primary_reads += 1
+            return self.session_maker
+        replica: Replica = healthy[next(self._next_replica) % len(healthy)]
+        replica.reads += 1
+        return replica.session_maker
+
+    def pool_status(self) -> dict:
+        pool: QueuePool = self.engine.pool
+        return {
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow()
+        }
+
+    def replica_status(self) -> dict:
+        return {
+            'replicas': len(self._replicas),
+            'healthy': sum(replica.healthy for replica in self._replicas),
+            'primary_reads': self.primary_reads,
+            'replica_reads': sum(replica.reads for replica in self._replicas),
+            'servers': [replica.status() for replica in self._replicas]
+        }
 
     async def get_session_async(self) -> AsyncGenerator[AsyncSession, None]:
+        session: AsyncSession = self.session_maker()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    async def get_read_session_async(self) -> AsyncGenerator[AsyncSession, None]:
+        session: AsyncSession = self.read_session_maker()()
         try:
-            air_engine: AsyncEngine = create_async_engine(self._url_async)
-            air_async_session = sessionmaker(air_engine, class_=AsyncSession, expire_on_commit=False)
-            session: AsyncSession = air_async_session()
             yield session
         finally:
             await session.close()
@@ -1,10 +1,11 @@
 import os
+from functools import cached_property, lru_cache
 from pathlib import Path
 
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
-from .database import DataBaseServer
+from .database import DataBaseServer, PoolOptions
 
 load_dotenv()
 
@@ -12,15 +13,162 @@ class Settings(BaseSettings):
     algorithm: str
     private_key_file: Path
     public_key_file: Path
+    previous_public_key_files: str = os.environ.get("PREVIOUS_PUBLIC_KEY_FILES", "")
+    key_id: str | None = os.environ.get("KEY_ID")
     access_token_expire_minutes: int = os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 30)
     refresh_token_expire_days: int = os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 14)
 
-    database: DataBaseServer = DataBaseServer(
-        os.environ.get("DB_HOST"), 
-        os.environ.get("DB_PORT"), 
-        os.environ.get("DB_USER"), 
-        os.environ.get("DB_PASS"), 
-        os.environ.get("DB_NAME")
-    )
+    db_host: str | None = os.environ.get("DB_HOST")
+    db_port: str | None = os.environ.get("DB_PORT")
+    db_user: str | None = os.environ.get("DB_USER")
+    db_pass: str | None = os.environ.get("DB_PASS")
+    db_name: str | None = os.environ.get("DB_NAME")
+    db_pool_size: int = os.environ.get("DB_POOL_SIZE", 5)
+    db_max_overflow: int = os.environ.get("DB_MAX_OVERFLOW", 10)
+    db_pool_pre_ping: bool = os.environ.get("DB_POOL_PRE_PING", True)
+    db_pool_recycle: int = os.environ.get("DB_POOL_RECYCLE", 1800)
+    db_statement_cache_size: int = os.environ.get("DB_STATEMENT_CACHE_SIZE", 100)
+    db_connection_budget: int = os.environ.get("DB_CONNECTION_BUDGET", 0)
+    db_replica_urls: str = os.environ.get("DB_REPLICA_URLS", "")
+    db_replica_check_interval: float = os.environ.get("DB_REPLICA_CHECK_INTERVAL", 5.0)
+    db_replica_max_lag: float = os.environ.get("DB_REPLICA_MAX_LAG", 10.0)
+    db_read_your_writes_seconds: float = os.environ.get("DB_READ_YOUR_WRITES_SECONDS", 10.0)
+
+    password_executor: str = os.environ.get("PASSWORD_EXECUTOR", "thread")
+    password_workers: int = os.environ.get("PASSWORD_WORKERS", 0)
+    password_queue_size: int = os.environ.get("PASSWORD_QUEUE_SIZE", 64)
+    password_scheme: str = os.environ.get("PASSWORD_SCHEME", "bcrypt")
+    bcrypt_rounds: int = os.environ.get("BCRYPT_ROUNDS", 12)
+    argon2_time_cost: int = os.environ.get("ARGON2_TIME_COST", 3)
+    argon2_memory_cost: int = os.environ.get("ARGON2_MEMORY_COST", 65536)
+    argon2_parallelism: int = os.environ.get("ARGON2_PARALLELISM", 1)
+
+    login_rate_per_login: float = os.environ.get("LOGIN_RATE_PER_LOGIN", 0.1)
+    login_burst_per_login: int = os.environ.get("LOGIN_BURST_PER_LOGIN", 5)
+    login_rate_per_ip: float = os.environ.get("LOGIN_RATE_PER_IP", 5.0)
+    login_burst_per_ip: int = os.environ.get("LOGIN_BURST_PER_IP", 50)
+    login_rate_max_keys: int = os.environ.get("LOGIN_RATE_MAX_KEYS", 100000)
+    login_concurrency: int = os.environ.get("LOGIN_CONCURRENCY", 0)
+    login_queue_timeout: float = os.environ.get("LOGIN_QUEUE_TIMEOUT", 1.0)
+
+    token_cache_size: int = os.environ.get("TOKEN_CACHE_SIZE", 10000)
+    token_cache_ttl: int = os.environ.get("TOKEN_CACHE_TTL", 300)
+
+    token_write_behind: bool = os.environ.get("TOKEN_WRITE_BEHIND", False)
+    token_batch_size: int = os.environ.get("TOKEN_BATCH_SIZE", 500)
+    token_flush_interval: float = os.environ.get("TOKEN_FLUSH_INTERVAL", 0.05)
+    token_buffer_size: int = os.environ.get("TOKEN_BUFFER_SIZE", 10000)
+
+    token_reaper_enabled: bool = os.environ.get("TOKEN_REAPER_ENABLED", True)
+    token_reaper_interval: int = os.environ.get("TOKEN_REAPER_INTERVAL", 300)
+    token_reaper_batch_size: int = os.environ.get("TOKEN_REAPER_BATCH_SIZE", 5000)
+    token_retention_hours: int = os.environ.get("TOKEN_RETENTION_HOURS", 24)
+    token_partition_days_ahead: int = os.environ.get("TOKEN_PARTITION_DAYS_AHEAD", 7)
+
+    revocation_capacity: int = os.environ.get("REVOCATION_CAPACITY", 100000)
+    revocation_error_rate: float = os.environ.get("REVOCATION_ERROR_RATE", 0.001)
+    revocation_rebuild_interval: float = os.environ.get("REVOCATION_REBUILD_INTERVAL", 3600)
+
+    invalidation_enabled: bool = os.environ.get("INVALIDATION_ENABLED", True)
+    invalidation_channel: str = os.environ.get("INVALIDATION_CHANNEL", "cache_invalidation")
+    invalidation_queue_size: int = os.environ.get("INVALIDATION_QUEUE_SIZE", 10000)
+    invalidation_batch_size: int = os.environ.get("INVALIDATION_BATCH_SIZE", 500)
+    invalidation_ping_interval: float = os.environ.get("INVALIDATION_PING_INTERVAL", 10.0)
+    invalidation_reconnect_delay: float = os.environ.get("INVALIDATION_RECONNECT_DELAY", 1.0)
+    invalidation_max_reconnect_delay: float = os.environ.get("INVALIDATION_MAX_RECONNECT_DELAY", 30.0)
+
+    salary_cache_size: int = os.environ.get("SALARY_CACHE_SIZE", 10000)
+    salary_cache_ttl: int = os.environ.get("SALARY_CACHE_TTL", 60)
+
+    salary_raise_enabled: bool = os.environ.get("SALARY_RAISE_ENABLED", False)
+    salary_raise_interval: int = os.environ.get("SALARY_RAISE_INTERVAL", 3600)
+    salary_raise_chunk_size: int = os.environ.get("SALARY_RAISE_CHUNK_SIZE", 1000)
+    salary_raise_percent: float = os.environ.get("SALARY_RAISE_PERCENT", 10.0)
+    salary_raise_interval_months: int = os.environ.get("SALARY_RAISE_INTERVAL_MONTHS", 12)
+    salary_raise_lock_timeout: str = os.environ.get("SALARY_RAISE_LOCK_TIMEOUT", "2s")
+
+    salary_export_logins: str = os.environ.get("SALARY_EXPORT_LOGINS", "")
+    salary_export_page_size: int = os.environ.get("SALARY_EXPORT_PAGE_SIZE", 10000)
+    salary_export_fetch_size: int = os.environ.get("SALARY_EXPORT_FETCH_SIZE", 1000)
+
+    bulk_import_chunk_size: int = os.environ.get("BULK_IMPORT_CHUNK_SIZE", 1000)
+    bulk_import_spool_size: int = os.environ.get("BULK_IMPORT_SPOOL_SIZE", 1048576)
 
     log_config_file: str
+    log_mode: str = os.environ.get("LOG_MODE", "sync")
+    log_format: str = os.environ.get("LOG_FORMAT", "text")
+    log_queue_size: int = os.environ.get("LOG_QUEUE_SIZE", 10000)
+    log_sample_rate: float = os.environ.get("LOG_SAMPLE_RATE", 1.0)
+
+    fast_responses: bool = os.environ.get("FAST_RESPONSES", False)
+
+    web_host: str = os.environ.get("WEB_HOST", "0.0.0.0")
+    web_port: int = os.environ.get("WEB_PORT", 8000)
+    web_workers: int = os.environ.get("WEB_WORKERS", 1)
+    web_graceful_timeout: int = os.environ.get("WEB_GRACEFUL_TIMEOUT", 30)
+
+    migration_lock_timeout: str = os.environ.get("MIGRATION_LOCK_TIMEOUT", "2s")
+    migration_lock_retries: int = os.environ.get("MIGRATION_LOCK_RETRIES", 10)
+    migration_retry_delay: float = os.environ.get("MIGRATION_RETRY_DELAY", 1.0)
+    migration_backfill_batch_size: int = os.environ.get("MIGRATION_BACKFILL_BATCH_SIZE", 5000)
+    migration_backfill_pause: float = os.environ.get("MIGRATION_BACKFILL_PAUSE", 0.1)
+
+    diagnostics_enabled: bool = os.environ.get("DIAGNOSTICS_ENABLED", False)
+    diagnostics_slow_ms: float = os.environ.get("DIAGNOSTICS_SLOW_MS", 100.0)
+    diagnostics_sample_rate: float = os.environ.get("DIAGNOSTICS_SAMPLE_RATE", 0.1)
+    diagnostics_queue_size: int = os.environ.get("DIAGNOSTICS_QUEUE_SIZE", 100)
+    diagnostics_logins: str = os.environ.get("DIAGNOSTICS_LOGINS", "")
+
+    startup_profile: bool = os.environ.get("STARTUP_PROFILE", False)
+
+    @cached_property
+    def database(self) -> DataBaseServer:
+        return DataBaseServer(self.db_host, self.db_port, self.db_user, self.db_pass, self.db_name, self.replica_urls)
+
+    @property
+    def previous_public_key_paths(self) -> list[Path]:
+        return [Path(path.strip()) for path in self.previous_public_key_files.split(",") if path.strip()]
+
+    @property
+    def replica_urls(self) -> list[str]:
+        return [url.strip() for url in self.db_replica_urls.split(",") if url.strip()]
+
+    @property
+    def salary_export_login_list(self) -> set[str]:
+        return { login.strip() for login in self.salary_export_logins.split(",") if login.strip() }
+
+    @property
+    def diagnostics_login_list(self) -> set[str]:
+        return { login.strip() for login in self.diagnostics_logins.split(",") if login.strip() }
+
+    @property
+    def worker_count(self) -> int:
+        return self.web_workers or os.cpu_count() or 1
+
+    @property
+    def cpus_per_worker(self) -> int:
+        return max(1, (os.cpu_count() or 1) // self.worker_count)
+
+    @property
+    def pool_options(self) -> PoolOptions:
+        pool_size: int = self.db_pool_size
+        max_overflow: int = self.db_max_overflow
+        if self.db_connection_budget:
+            # every worker gets an equal share of the budget, less its invalidation listener that lives
+            # outside the pools, and splits it over one pool per server in the configured size/overflow ratio
+            per_worker: int = self.db_connection_budget // self.worker_count - int(self.invalidation_enabled)
+            per_engine: int = max(1, per_worker // (1+len(self.replica_urls)))
+            pool_size = max(1, round(per_engine*self.db_pool_size/(self.db_pool_size+self.db_max_overflow)))
+            max_overflow = max(0, per_engine-pool_size)
+        return PoolOptions(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=self.db_pool_pre_ping,
+            pool_recycle=self.db_pool_recycle,
+            statement_cache_size=self.db_statement_cache_size
+        )
+
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
@@ -1,20 +1,106 @@
 import os
 import json
+import queue
+import random
+import atexit
 import logging
 import logging.config
+from logging.handlers import QueueHandler, QueueListener
 
-from config.settings import Settings
+from config.settings import Settings, get_settings
+
+settings: Settings = get_settings()
+
+# pass as extra= to mark info records that may be sampled out under load
+HOT_PATH: dict = { 'hot_path': True }
+RECORD_ATTRIBUTES: frozenset[str] = frozenset(vars(logging.makeLogRecord({}))) | { 'message', 'asctime', 'hot_path' }
+
+_configured: bool = False
+_queue_handlers: list["DroppingQueueHandler"] = []
+_listeners: list[QueueListener] = []
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update({ key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES })
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not getattr(record, 'hot_path', False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, queue: queue.Queue) -> None:
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # message formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-settings: Settings = Settings()
 
 def create_log_dir(dir: str) -> None:
     if not os.path.exists(dir):
         os.mkdir(dir)
 
-def init_logger(name: str) -> logging:
+def configure_logging() -> None:
+    global _configured
+    if _configured:
+        return
     create_log_dir('log/')
     with open(settings.log_config_file, "r") as f:
         dict_config = json.load(f)
-        dict_config["loggers"][name] = dict_config["loggers"][name]
     logging.config.dictConfig(dict_config)
+
+    sampling: SamplingFilter = SamplingFilter(settings.log_sample_rate)
+    for name in dict_config["loggers"]:
+        logger: logging.Logger = logging.getLogger(name)
+        logger.addFilter(sampling)
+        if settings.log_format == "json":
+            for handler in logger.handlers:
+                handler.setFormatter(JSONFormatter())
+        if settings.log_mode == "queue":
+            queue_handler: DroppingQueueHandler = DroppingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+            listener: QueueListener = QueueListener(queue_handler.queue, *logger.handlers, respect_handler_level=True)
+            logger.handlers = [queue_handler]
+            listener.start()
+            _queue_handlers.append(queue_handler)
+            _listeners.append(listener)
+    atexit.register(stop_logging)
+    _configured = True
+
+def stop_logging() -> None:
+    while _listeners:
+        _listeners.pop().stop()
+
+def logging_stats() -> dict:
+    return {
+        'queued': sum(handler.queue.qsize() for handler in _queue_handlers),
+        'dropped': sum(handler.dropped for handler in _queue_handlers)
+    }
+
+def init_logger(name: str) -> logging:
+    configure_logging()
     return logging.getLogger(name)
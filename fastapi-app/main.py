@@ -1,8 +1,96 @@
+from time import perf_counter
+
+IMPORT_STARTED: float = perf_counter()
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 
-from config.settings import Settings
+from config.settings import Settings, get_settings
+from loggers import init_logger, logging_stats
+from src.diagnostics import DiagnosticsMiddleware, diagnostics
+from src.handlers.admission import login_admission
+from src.handlers.password import password_service
+from src.handlers.revocation import revocation_index
+from src.handlers.salary_raise import salary_raiser
+from src.handlers.token import get_key_manager, token_cache, token_writer
+from src.handlers.token_reaper import token_reaper
+from src.handlers.user import salary_cache
+from src.invalidation import invalidation_bus
+from src.metrics import MetricsMiddleware, instrument_engine, registry
+from src.profiling import StartupProfiler
 from src.routers import router
 
-app = FastAPI()
-app.include_router(router)
-settings: Settings = Settings()
+IMPORT_SECONDS: float = perf_counter()-IMPORT_STARTED
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    settings: Settings = app.state.settings
+    profiler: StartupProfiler = app.state.profiler
+    with profiler.phase("keys"):
+        get_key_manager()
+    with profiler.phase("database"):
+        instrument_engine(settings.database.connect(settings.pool_options))
+        diagnostics.instrument(settings.database.engine)
+        for engine in settings.database.replica_engines:
+            instrument_engine(engine)
+            diagnostics.instrument(engine)
+        settings.database.start_health_checks(settings.db_replica_check_interval, settings.db_replica_max_lag)
+    with profiler.phase("password_service"):
+        password_service.start()
+    with profiler.phase("invalidation_bus"):
+        invalidation_bus.start()
+    with profiler.phase("diagnostics"):
+        diagnostics.start(settings.database.engine)
+    with profiler.phase("token_writer"):
+        token_writer.start()
+    with profiler.phase("revocation_index"):
+        await revocation_index.load()
+        revocation_index.start()
+    with profiler.phase("token_reaper"):
+        token_reaper.start()
+    with profiler.phase("salary_raiser"):
+        salary_raiser.start()
+    if profiler.enabled:
+        init_logger("app").info('Startup profile: %s', profiler.report())
+    yield
+    await salary_raiser.stop()
+    await token_reaper.stop()
+    await revocation_index.stop()
+    await token_writer.stop()
+    await diagnostics.stop()
+    await invalidation_bus.stop()
+    password_service.shutdown()
+    await settings.database.disconnect()
+
+def create_app() -> FastAPI:
+    # the background jobs are bound to the process settings, the app uses the same instance
+    settings: Settings = get_settings()
+    profiler: StartupProfiler = StartupProfiler(settings.startup_profile)
+    profiler.record("imports", IMPORT_SECONDS)
+    with profiler.phase("app"):
+        app: FastAPI = FastAPI(lifespan=lifespan)
+        app.state.settings = settings
+        app.state.profiler = profiler
+        app.include_router(router)
+        app.add_middleware(MetricsMiddleware)
+        app.add_middleware(DiagnosticsMiddleware)
+
+    registry.register_stats("db_pool", settings.database.pool_status)
+    registry.register_stats("db_replicas", settings.database.replica_status)
+    registry.register_stats("password_service", password_service.stats)
+    registry.register_stats("login_admission", login_admission.stats)
+    registry.register_stats("token_cache", token_cache.stats)
+    registry.register_stats("token_writer", token_writer.stats)
+    registry.register_stats("token_revocation", revocation_index.stats)
+    registry.register_stats("salary_cache", salary_cache.stats)
+    registry.register_stats("invalidation_bus", invalidation_bus.stats)
+    registry.register_stats("salary_raiser", salary_raiser.stats)
+    registry.register_stats("diagnostics", diagnostics.stats)
+    registry.register_stats("logging", logging_stats)
+    registry.register_stats("startup", profiler.report)
+    return app
+
+app: FastAPI = create_app()
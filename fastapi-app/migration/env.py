@@ -3,13 +3,16 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from alembic import context
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy.engine import Connection
 
 from config.database import DataBaseServer
-from config.settings import Settings
+from config.settings import Settings, get_settings
+from migration.online import StatementBuffer, lock_impact, logger, retry_on_lock
 
 from src.models import ShiftBase
 
-settings: Settings = Settings()
+settings: Settings = get_settings()
 database: DataBaseServer = settings.database
 
 # this is the Alembic Config object, which provides
@@ -46,6 +49,40 @@ def include_object(object, name, type_, reflected, compare_to):
         return True
 
 
+def run_preflight(connection: Connection) -> None:
+    """Render the pending migrations and report the locks they would take.
+
+    Nothing is applied: the statements are rendered offline starting from
+    the database's current revision, and each one is matched against the
+    affected table's size, current lock holders and oldest transaction.
+
+    """
+    heads = MigrationContext.configure(
+        connection, opts={"version_table": "alembic", "version_table_schema": "public"}
+    ).get_current_heads()
+    buffer = StatementBuffer()
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url"),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        as_sql=True,
+        output_buffer=buffer,
+        starting_rev=heads[0] if heads else None,
+        transaction_per_migration=True,
+        version_table='alembic',
+        version_table_schema='public'
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+    for item in lock_impact(connection, buffer.statements):
+        logger.info(
+            f"[{item['risk']}] {item['lock']} on {item['table']} blocks {item['blocks']}, "
+            f"rows={item['rows']}, bytes={item['bytes']}, scans_table={item['scans_table']}, "
+            f"lock_holders={item['lock_holders']}, wait_seconds={item['wait_seconds']:.1f}: {item['statement']}"
+        )
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -64,6 +101,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -84,17 +122,36 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        # a statement waiting for a lock gives up after lock_timeout
+        # instead of holding back the queries queued behind it
+        connection.exec_driver_sql(f"SET lock_timeout = '{settings.migration_lock_timeout}'")
+        connection.commit()
+
+        if context.get_x_argument(as_dictionary=True).get("preflight") == "true":
+            run_preflight(connection)
+            return
+
         context.configure(
             connection=connection, 
             target_metadata=target_metadata,
             version_table='alembic',
             version_table_schema='public',
             include_object=include_object,
-            include_schemas=True
+            include_schemas=True,
+            transaction_per_migration=True
         )
 
-        with context.begin_transaction():
-            context.run_migrations()
+        def run_migrations() -> None:
+            with context.begin_transaction():
+                context.run_migrations()
+
+        def rollback() -> None:
+            if connection.in_transaction():
+                connection.rollback()
+
+        # applied revisions are committed one by one, a retry resumes
+        # from the revision that timed out
+        retry_on_lock(run_migrations, "Migrations", cleanup=rollback)
 
 
 if context.is_offline_mode():
@@ -0,0 +1,318 @@
+from time import perf_counter, sleep
+from typing import Callable, Sequence, TypeVar
+import logging
+import re
+
+from alembic import op
+from sqlalchemy import TextClause, exc, text
+from sqlalchemy.engine import Connection, RowMapping
+
+from config.settings import Settings, get_settings
+
+
+LOCK_NOT_AVAILABLE: str = "55P03"
+MAX_RETRY_DELAY: float = 30.0
+
+BLOCKS_NOTHING: str = "nothing"
+BLOCKS_ROWS: str = "touched rows"
+BLOCKS_WRITES: str = "writes"
+BLOCKS_ALL: str = "reads and writes"
+
+# first match wins, the lock is the one taken on the affected table
+LOCK_RULES: tuple[tuple[re.Pattern, str, str], ...] = tuple(
+    (re.compile(pattern, re.IGNORECASE | re.DOTALL), lock, blocks) for pattern, lock, blocks in (
+        (r"^(CREATE|DROP|REINDEX)\b.*\bCONCURRENTLY\b", "SHARE UPDATE EXCLUSIVE", BLOCKS_NOTHING),
+        (r"^CREATE (UNIQUE )?INDEX\b", "SHARE", BLOCKS_WRITES),
+        (r"^ALTER INDEX\b.*\bRENAME\b", "SHARE UPDATE EXCLUSIVE", BLOCKS_NOTHING),
+        (r"^ALTER TABLE\b.*\bVALIDATE CONSTRAINT\b", "SHARE UPDATE EXCLUSIVE", BLOCKS_NOTHING),
+        (r"^ALTER TABLE\b.*\bFOREIGN KEY\b", "SHARE ROW EXCLUSIVE", BLOCKS_WRITES),
+        (r"^(UPDATE|DELETE|INSERT|MERGE|WITH)\b", "ROW EXCLUSIVE", BLOCKS_ROWS),
+        (r"^CREATE (OR REPLACE )?FUNCTION\b", "-", BLOCKS_NOTHING),
+        (r"^CREATE (OR REPLACE )?TRIGGER\b", "SHARE ROW EXCLUSIVE", BLOCKS_WRITES),
+        (r"^CREATE TABLE\b(?!.*\bPARTITION OF\b)", "-", BLOCKS_NOTHING),
+        (r"^(ALTER|DROP|TRUNCATE|LOCK|CREATE TABLE)\b", "ACCESS EXCLUSIVE", BLOCKS_ALL)
+    )
+)
+# statements that read or rewrite the whole table while holding their lock
+SCAN_PATTERN: re.Pattern = re.compile(
+    r"\b(ALTER COLUMN \S+ (SET DATA )?TYPE|SET NOT NULL|PRIMARY KEY|UNIQUE|CHECK|CREATE (UNIQUE )?INDEX)\b", re.IGNORECASE
+)
+TABLE_PATTERNS: tuple[re.Pattern, ...] = tuple(
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r"\bPARTITION OF ([\w.\"]+)",
+        r"^CREATE (?:UNIQUE )?INDEX\b.*?\bON (?:ONLY )?([\w.\"]+)",
+        r"^(?:CREATE (?:OR REPLACE )?|DROP )TRIGGER\b.*?\bON ([\w.\"]+)",
+        r"^ALTER TABLE (?:IF EXISTS )?(?:ONLY )?([\w.\"]+)",
+        r"^(?:UPDATE|DELETE FROM|INSERT INTO|TRUNCATE(?: TABLE)?|DROP TABLE(?: IF EXISTS)?|LOCK(?: TABLE)?) (?:ONLY )?([\w.\"]+)"
+    )
+)
+INDEX_PATTERN: re.Pattern = re.compile(
+    r"^(?:DROP|ALTER) INDEX (?:CONCURRENTLY )?(?:IF EXISTS )?([\w.\"]+)", re.IGNORECASE
+)
+SKIPPED_PATTERN: re.Pattern = re.compile(r"^(BEGIN|COMMIT)\b|^--|\bpublic\.alembic\b", re.IGNORECASE)
+
+INDEX_IS_INVALID: TextClause = text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)")
+INDEX_TABLE: TextClause = text("SELECT indrelid::regclass::text FROM pg_index WHERE indexrelid = to_regclass(:name)")
+TABLE_IMPACT: TextClause = text("""
+    SELECT c.reltuples::bigint AS rows,
+           pg_total_relation_size(c.oid) AS bytes,
+           count(DISTINCT l.pid) FILTER (WHERE l.pid <> pg_backend_pid()) AS lock_holders
+    FROM pg_class c
+    LEFT JOIN pg_locks l ON l.relation = c.oid AND l.granted
+    WHERE c.oid = to_regclass(:name)
+    GROUP BY c.oid, c.reltuples
+""")
+OLDEST_TRANSACTION: TextClause = text("""
+    SELECT coalesce(extract(epoch FROM max(now() - xact_start)), 0)
+    FROM pg_stat_activity
+    WHERE xact_start IS NOT NULL AND pid <> pg_backend_pid() AND datname = current_database()
+""")
+
+settings: Settings = get_settings()
+logger: logging.Logger = logging.getLogger("alembic.online")
+
+T = TypeVar("T")
+
+
+def is_lock_timeout(err: exc.DBAPIError) -> bool:
+    return getattr(err.orig, "pgcode", None) == LOCK_NOT_AVAILABLE
+
+def retry_on_lock(fn: Callable[[], T], what: str, cleanup: Callable[[], None] | None = None) -> T:
+    # a statement that cannot get its lock within lock_timeout gives up instead of queueing
+    # user traffic behind it, and is tried again after a pause
+    delay: float = settings.migration_retry_delay
+    attempt: int = 0
+    while True:
+        try:
+            return fn()
+        except exc.DBAPIError as err:
+            if not is_lock_timeout(err) or attempt >= settings.migration_lock_retries:
+                raise
+            attempt += 1
+            logger.warning(
+                f'{what}: lock not granted within {settings.migration_lock_timeout}, '
+                f'retry {attempt}/{settings.migration_lock_retries} in {delay:.1f}s'
+            )
+            if cleanup is not None:
+                cleanup()
+            sleep(delay)
+            delay = min(delay*2, MAX_RETRY_DELAY)
+
+
+def _drop_invalid_index(index_name: str) -> None:
+    # an interrupted CREATE INDEX CONCURRENTLY leaves an invalid index that IF NOT EXISTS would keep
+    if op.get_context().as_sql:
+        return
+    if op.get_bind().execute(INDEX_IS_INVALID, { 'name': index_name }).scalar():
+        logger.info(f'Drop invalid index {index_name!r} left by an interrupted build')
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+def create_index_concurrently(index_name: str, table_name: str, columns: Sequence[str], unique: bool = False, **kw) -> None:
+    def create() -> None:
+        _drop_invalid_index(index_name)
+        op.create_index(
+            index_name, table_name, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True, **kw
+        )
+
+    with op.get_context().autocommit_block():
+        retry_on_lock(create, f'Create index {index_name!r}')
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    with op.get_context().autocommit_block():
+        retry_on_lock(
+            lambda: op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True),
+            f'Drop index {index_name!r}'
+        )
+
+def replace_index_concurrently(index_name: str, table_name: str, columns: Sequence[str], unique: bool = False, **kw) -> None:
+    # the new index is built next to the old one, so lookups are served by one of them at every step
+    new_name: str = f"{index_name[:59]}_new"
+    create_index_concurrently(new_name, table_name, columns, unique=unique, **kw)
+    drop_index_concurrently(index_name, table_name)
+    with op.get_context().autocommit_block():
+        retry_on_lock(
+            lambda: op.execute(f"ALTER INDEX {new_name} RENAME TO {index_name}"),
+            f'Rename index {new_name!r}'
+        )
+
+def _run_batches(what: str, first: TextClause, following: TextClause, total: int, batch_size: int, pause: float) -> int:
+    connection: Connection = op.get_bind()
+    logger.info(f'{what}: {total} rows in batches of {batch_size}')
+    started: float = perf_counter()
+    after = None
+    processed: int = 0
+    while True:
+        statement: TextClause = first if after is None else following
+        params: dict = { 'batch_size': batch_size } if after is None else { 'batch_size': batch_size, 'after': after }
+        # every batch commits on its own, row locks are held only for one batch
+        keys: list = retry_on_lock(
+            lambda: connection.execute(statement, params).scalars().all(),
+            what
+        )
+        if not keys:
+            break
+        after = max(keys)
+        processed += len(keys)
+        seconds: float = perf_counter()-started
+        rate: float = processed/seconds if seconds else 0.0
+        logger.info(
+            f'{what}: {processed}/{total} rows, {rate:.0f} rows/s, '
+            f'eta {max(total-processed, 0)/rate if rate else 0:.0f}s'
+        )
+        sleep(pause)
+    return processed
+
+def backfill(
+    table_name: str,
+    values: str,
+    where: str,
+    key: str = "id",
+    batch_size: int | None = None,
+    pause: float | None = None
+) -> int:
+    # `values` and `where` are SQL over the table aliased as t; `where` must stop matching
+    # a row once it is backfilled, so a restarted migration continues where it stopped
+    if op.get_context().as_sql:
+        op.execute(f"UPDATE {table_name} AS t SET {values} WHERE {where}")
+        return 0
+    batch_size = batch_size or settings.migration_backfill_batch_size
+    pause = settings.migration_backfill_pause if pause is None else pause
+
+    def batch(condition: str) -> TextClause:
+        return text(f"""
+            WITH batch AS (
+                SELECT {key} FROM {table_name} AS t WHERE {condition}({where}) ORDER BY {key} LIMIT :batch_size
+            )
+            UPDATE {table_name} AS t SET {values} FROM batch WHERE t.{key} = batch.{key}
+            RETURNING t.{key}
+        """)
+
+    first: TextClause = batch("")
+    following: TextClause = batch(f"{key} > :after AND ")
+
+    with op.get_context().autocommit_block():
+        total: int = op.get_bind().execute(text(f"SELECT count(*) FROM {table_name} AS t WHERE {where}")).scalar_one()
+        return _run_batches(f'Backfill {table_name}', first, following, total, batch_size, pause)
+
+def delete_rows(
+    table_name: str,
+    where: str,
+    key: str = "id",
+    batch_size: int | None = None,
+    pause: float | None = None
+) -> int:
+    # `where` is SQL over the table aliased as t, deleted rows stop matching by themselves
+    if op.get_context().as_sql:
+        op.execute(f"DELETE FROM {table_name} AS t WHERE {where}")
+        return 0
+    batch_size = batch_size or settings.migration_backfill_batch_size
+    pause = settings.migration_backfill_pause if pause is None else pause
+
+    def batch(condition: str) -> TextClause:
+        return text(f"""
+            WITH batch AS (
+                SELECT {key} FROM {table_name} AS t WHERE {condition}({where}) ORDER BY {key} LIMIT :batch_size
+            )
+            DELETE FROM {table_name} AS t USING batch WHERE t.{key} = batch.{key}
+            RETURNING t.{key}
+        """)
+
+    first: TextClause = batch("")
+    following: TextClause = batch(f"{key} > :after AND ")
+
+    with op.get_context().autocommit_block():
+        total: int = op.get_bind().execute(text(f"SELECT count(*) FROM {table_name} AS t WHERE {where}")).scalar_one()
+        return _run_batches(f'Delete from {table_name}', first, following, total, batch_size, pause)
+
+def copy_rows(
+    source: str,
+    target: str,
+    columns: Sequence[str],
+    key: str = "id",
+    batch_size: int | None = None,
+    pause: float | None = None
+) -> int:
+    # rows already in the target are skipped, so a restarted migration continues where it stopped;
+    # writes to the source during the copy have to reach the target another way, e.g. a trigger
+    column_list: str = ", ".join(columns)
+    if op.get_context().as_sql:
+        op.execute(f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {source} ON CONFLICT DO NOTHING")
+        return 0
+    batch_size = batch_size or settings.migration_backfill_batch_size
+    pause = settings.migration_backfill_pause if pause is None else pause
+
+    def batch(condition: str) -> TextClause:
+        # the batch locks its source rows, a concurrent update either waits for the copy or is read by it
+        return text(f"""
+            WITH batch AS (
+                SELECT {column_list} FROM {source} {condition} ORDER BY {key} LIMIT :batch_size FOR UPDATE
+            ), copied AS (
+                INSERT INTO {target} ({column_list}) SELECT {column_list} FROM batch ON CONFLICT DO NOTHING
+            )
+            SELECT {key} FROM batch
+        """)
+
+    first: TextClause = batch("")
+    following: TextClause = batch(f"WHERE {key} > :after")
+
+    with op.get_context().autocommit_block():
+        total: int = op.get_bind().execute(text(f"SELECT count(*) FROM {source}")).scalar_one()
+        return _run_batches(f'Copy {source} to {target}', first, following, total, batch_size, pause)
+
+
+class StatementBuffer:
+    # output buffer for offline rendering, alembic writes one statement per call
+    def __init__(self) -> None:
+        self.statements: list[str] = []
+
+    def write(self, text: str) -> None:
+        statement: str = text.strip().rstrip(";").strip()
+        if statement and not SKIPPED_PATTERN.search(statement):
+            self.statements.append(statement)
+
+    def flush(self) -> None:
+        pass
+
+
+def _affected_table(connection: Connection, statement: str) -> str | None:
+    for pattern in TABLE_PATTERNS:
+        if (match := pattern.search(statement)):
+            return match.group(1)
+    if (match := INDEX_PATTERN.search(statement)):
+        return connection.execute(INDEX_TABLE, { 'name': match.group(1) }).scalar()
+    return None
+
+def lock_impact(connection: Connection, statements: Sequence[str]) -> list[dict]:
+    oldest: float = float(connection.execute(OLDEST_TRANSACTION).scalar_one())
+    report: list[dict] = []
+    for statement in statements:
+        lock, blocks = next(
+            ((lock, blocks) for pattern, lock, blocks in LOCK_RULES if pattern.search(statement)),
+            ("ACCESS EXCLUSIVE", BLOCKS_ALL)
+        )
+        table: str | None = _affected_table(connection, statement)
+        impact: RowMapping | None = connection.execute(TABLE_IMPACT, { 'name': table }).mappings().fetchone() if table else None
+        rows: int = max(impact['rows'], 0) if impact else 0
+        scans: bool = bool(SCAN_PATTERN.search(statement)) and blocks != BLOCKS_NOTHING
+        if blocks == BLOCKS_NOTHING:
+            risk: str = "low"
+        elif blocks == BLOCKS_ROWS:
+            risk = "medium" if rows else "low"
+        elif (scans and rows) or (impact and impact['lock_holders']):
+            risk = "high"
+        else:
+            risk = "medium"
+        report.append({
+            'statement': " ".join(statement.split()),
+            'table': table,
+            'lock': lock,
+            'blocks': blocks,
+            'scans_table': scans,
+            'rows': rows,
+            'bytes': impact['bytes'] if impact else 0,
+            'lock_holders': impact['lock_holders'] if impact else 0,
+            # a blocking lock waits for the oldest open transaction, and new queries queue behind it
+            'wait_seconds': oldest if blocks in (BLOCKS_WRITES, BLOCKS_ALL) else 0.0,
+            'risk': risk
+        })
+    return report
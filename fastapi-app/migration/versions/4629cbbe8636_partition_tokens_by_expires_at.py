@@ -0,0 +1,124 @@
+"""partition tokens by expires_at
+
+Revision ID: 4629cbbe8636
+Revises: c649d0d4786b
+Create Date: 2026-10-18 12:40:07.118254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config.settings import Settings, get_settings
+from migration.online import copy_rows, retry_on_lock
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4629cbbe8636'
+down_revision: Union[str, Sequence[str], None] = 'c649d0d4786b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+settings: Settings = get_settings()
+
+COLUMNS: tuple[str, ...] = ("id", "user_id", "token", "token_hash", "expires_at", "is_active")
+# new tokens land in the partitioned table from the start, its days have to cover the longest expiry
+PARTITION_DAYS_AHEAD: int = max(settings.token_partition_days_ahead, settings.refresh_token_expire_days+1)
+
+# keeps the partitioned copy in step with the live table until the swap
+MIRROR_FUNCTION: str = f"""
+    CREATE OR REPLACE FUNCTION tokens_mirror() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM tokens_partitioned WHERE id = OLD.id AND expires_at = OLD.expires_at;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO tokens_partitioned ({", ".join(COLUMNS)})
+            VALUES ({", ".join(f"NEW.{column}" for column in COLUMNS)})
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the partitioned table is filled next to the live one and swapped in at the end, every step
+    # before the swap can be repeated, so a revision retried on a lock timeout continues the copy
+    op.create_table('tokens_partitioned',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('token', sa.String(length=4000), nullable=False),
+    sa.Column('token_hash', sa.LargeBinary(length=32), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='tokens_partitioned_user_id_fkey'),
+    sa.PrimaryKeyConstraint('id', 'expires_at', name='tokens_partitioned_pkey'),
+    postgresql_partition_by='RANGE (expires_at)',
+    if_not_exists=True
+    )
+    op.create_index('ix_tokens_partitioned_token_hash', 'tokens_partitioned', ['token_hash', 'expires_at'], unique=True, if_not_exists=True)
+    op.execute("CREATE TABLE IF NOT EXISTS tokens_default PARTITION OF tokens_partitioned DEFAULT")
+    with op.get_context().autocommit_block():
+        # daily partitions cover every stored token, the default partition stays empty
+        # so the token reaper can keep attaching new days
+        op.execute(f"""
+            DO $$
+            DECLARE day date;
+            BEGIN
+                FOR day IN SELECT generate_series(
+                    least(current_date, (SELECT min(expires_at)::date FROM tokens)),
+                    greatest(current_date + {PARTITION_DAYS_AHEAD}, (SELECT max(expires_at)::date FROM tokens)),
+                    interval '1 day'
+                )::date LOOP
+                    EXECUTE format(
+                        'CREATE TABLE IF NOT EXISTS %I PARTITION OF tokens_partitioned FOR VALUES FROM (%L) TO (%L)',
+                        'tokens_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+                    );
+                END LOOP;
+            END $$
+        """)
+        op.execute(MIRROR_FUNCTION)
+        retry_on_lock(
+            lambda: op.execute(
+                "CREATE OR REPLACE TRIGGER tokens_mirror AFTER INSERT OR UPDATE OR DELETE ON tokens "
+                "FOR EACH ROW EXECUTE FUNCTION tokens_mirror()"
+            ),
+            'Create trigger tokens_mirror'
+        )
+    copy_rows('tokens', 'tokens_partitioned', COLUMNS)
+    # the swap is the only step that blocks token traffic, and only for the renames
+    op.drop_table('tokens')
+    op.execute("DROP FUNCTION tokens_mirror()")
+    # the new code writes token_hash itself, the trigger of the old table is gone with it
+    op.execute("DROP FUNCTION IF EXISTS tokens_fill_hash()")
+    op.rename_table('tokens_partitioned', 'tokens')
+    op.execute("ALTER TABLE tokens RENAME CONSTRAINT tokens_partitioned_pkey TO tokens_pkey")
+    op.execute("ALTER TABLE tokens RENAME CONSTRAINT tokens_partitioned_user_id_fkey TO tokens_user_id_fkey")
+    op.execute("ALTER INDEX ix_tokens_partitioned_token_hash RENAME TO ix_tokens_token_hash")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.rename_table('tokens', 'tokens_partitioned')
+    op.execute("ALTER INDEX ix_tokens_token_hash RENAME TO ix_tokens_partitioned_token_hash")
+    op.execute("ALTER TABLE tokens_partitioned RENAME CONSTRAINT tokens_pkey TO tokens_partitioned_pkey")
+    op.execute("ALTER TABLE tokens_partitioned RENAME CONSTRAINT tokens_user_id_fkey TO tokens_partitioned_user_id_fkey")
+    op.create_table('tokens',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('token', sa.String(length=4000), nullable=False),
+    sa.Column('token_hash', sa.LargeBinary(length=32), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("""
+        INSERT INTO tokens (id, user_id, token, token_hash, expires_at, is_active)
+        SELECT id, user_id, token, token_hash, expires_at, is_active FROM tokens_partitioned
+    """)
+    op.create_index(op.f('ix_tokens_token_hash'), 'tokens', ['token_hash'], unique=True)
+    op.drop_table('tokens_partitioned')
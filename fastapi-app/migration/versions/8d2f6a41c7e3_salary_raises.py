@@ -0,0 +1,61 @@
+"""salary raises
+
+Revision ID: 8d2f6a41c7e3
+Revises: 4629cbbe8636
+Create Date: 2026-10-18 15:02:44.390517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migration.online import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2f6a41c7e3'
+down_revision: Union[str, Sequence[str], None] = '4629cbbe8636'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('salary_raise_runs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('cutoff', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('last_employee_id', sa.UUID(), nullable=True),
+    sa.Column('processed', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_table('salary_raises',
+    sa.Column('id', sa.UUID(), server_default=sa.text('gen_random_uuid()'), nullable=False),
+    sa.Column('run_id', sa.UUID(), nullable=False),
+    sa.Column('employee_id', sa.UUID(), nullable=False),
+    sa.Column('old_salary', sa.Integer(), nullable=False),
+    sa.Column('new_salary', sa.Integer(), nullable=False),
+    sa.Column('old_raise_date', sa.DateTime(), nullable=False),
+    sa.Column('new_raise_date', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['employee_id'], ['employees.id'], ),
+    sa.ForeignKeyConstraint(['run_id'], ['salary_raise_runs.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index(op.f('ix_salary_raises_employee_id'), 'salary_raises', ['employee_id'], unique=False, if_not_exists=True)
+    op.create_index(op.f('ix_salary_raises_run_id'), 'salary_raises', ['run_id'], unique=False, if_not_exists=True)
+    # employees takes user traffic, its index is built without blocking writes; the new tables
+    # above are committed by then, so a retry of the revision skips them
+    create_index_concurrently(op.f('ix_employees_next_raise_date'), 'employees', ['next_raise_date'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_index_concurrently(op.f('ix_employees_next_raise_date'), 'employees')
+    op.drop_index(op.f('ix_salary_raises_run_id'), table_name='salary_raises')
+    op.drop_index(op.f('ix_salary_raises_employee_id'), table_name='salary_raises')
+    op.drop_table('salary_raises')
+    op.drop_table('salary_raise_runs')
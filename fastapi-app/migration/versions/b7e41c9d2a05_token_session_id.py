@@ -0,0 +1,28 @@
+"""token session id
+
+Revision ID: b7e41c9d2a05
+Revises: 8d2f6a41c7e3
+Create Date: 2026-10-18 18:20:11.504219
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e41c9d2a05'
+down_revision: Union[str, Sequence[str], None] = '8d2f6a41c7e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tokens', sa.Column('session_id', sa.UUID(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('tokens', 'session_id')
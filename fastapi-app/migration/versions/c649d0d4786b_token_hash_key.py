@@ -0,0 +1,69 @@
+"""token hash key
+
+Revision ID: c649d0d4786b
+Revises: ce985d941be1
+Create Date: 2026-10-18 10:12:41.508213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migration.online import backfill, create_index_concurrently, delete_rows, drop_index_concurrently, retry_on_lock
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c649d0d4786b'
+down_revision: Union[str, Sequence[str], None] = 'ce985d941be1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+NOT_NULL_CHECK: str = "tokens_token_hash_not_null"
+
+# the previous release keeps inserting tokens until the rollout ends, their hashes are filled in here
+FILL_HASH_FUNCTION: str = """
+    CREATE OR REPLACE FUNCTION tokens_fill_hash() RETURNS trigger AS $$
+    BEGIN
+        NEW.token_hash := sha256(convert_to(NEW.token, 'UTF8'));
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # every step can be repeated, a revision retried on a lock timeout continues where it stopped
+    op.add_column('tokens', sa.Column('token_hash', sa.LargeBinary(length=32), nullable=True), if_not_exists=True)
+    op.execute(FILL_HASH_FUNCTION)
+    op.execute(
+        "CREATE OR REPLACE TRIGGER tokens_fill_hash BEFORE INSERT OR UPDATE OF token ON tokens "
+        "FOR EACH ROW EXECUTE FUNCTION tokens_fill_hash()"
+    )
+    # identical JWTs could be issued within the same second before jti was added,
+    # equal tokens have equal hashes and ix_tokens_token finds them
+    delete_rows('tokens', "EXISTS (SELECT 1 FROM tokens b WHERE b.token = t.token AND b.id > t.id)")
+    backfill('tokens', "token_hash = sha256(convert_to(t.token, 'UTF8'))", "t.token_hash IS NULL")
+    # SET NOT NULL skips its table scan when a validated check proves it, and the check is
+    # validated without blocking writes; each step commits so no lock is held across the scan
+    with op.get_context().autocommit_block():
+        for statement in (
+            f"ALTER TABLE tokens DROP CONSTRAINT IF EXISTS {NOT_NULL_CHECK}, "
+            f"ADD CONSTRAINT {NOT_NULL_CHECK} CHECK (token_hash IS NOT NULL) NOT VALID",
+            f"ALTER TABLE tokens VALIDATE CONSTRAINT {NOT_NULL_CHECK}",
+            "ALTER TABLE tokens ALTER COLUMN token_hash SET NOT NULL",
+            f"ALTER TABLE tokens DROP CONSTRAINT {NOT_NULL_CHECK}"
+        ):
+            retry_on_lock(lambda: op.execute(statement), 'Set token_hash not null')
+    create_index_concurrently(op.f('ix_tokens_token_hash'), 'tokens', ['token_hash'], unique=True)
+    drop_index_concurrently(op.f('ix_tokens_token'), 'tokens')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_tokens_token_hash'), table_name='tokens')
+    op.create_index(op.f('ix_tokens_token'), 'tokens', ['token'], unique=False)
+    op.execute("DROP TRIGGER IF EXISTS tokens_fill_hash ON tokens")
+    op.execute("DROP FUNCTION IF EXISTS tokens_fill_hash()")
+    op.drop_column('tokens', 'token_hash')
@@ -0,0 +1,28 @@
+import uvicorn
+
+from config.settings import Settings, get_settings
+from loggers import init_logger
+from src.handlers.token import get_key_manager
+
+
+def main() -> None:
+    settings: Settings = get_settings()
+    # fail in the supervisor, before any worker is spawned, when the config or the keys are broken
+    get_key_manager()
+    init_logger("app").info(
+        f'Start {settings.worker_count} worker(s) on {settings.web_host}:{settings.web_port}, '
+        f'db pool per worker: {settings.pool_options}'
+    )
+    uvicorn.run(
+        "main:app",
+        host=settings.web_host,
+        port=settings.web_port,
+        workers=settings.worker_count,
+        loop="auto",
+        http="auto",
+        proxy_headers=True,
+        timeout_graceful_shutdown=settings.web_graceful_timeout
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from hashlib import sha256
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = math.ceil(-self.capacity*math.log(error_rate)/math.log(2)**2)
+        self.hash_count = max(1, round(self.size/self.capacity*math.log(2)))
+        self.count = 0
+        self._bits: bytearray = bytearray(math.ceil(self.size/8))
+
+    def _positions(self, key: bytes) -> list[int]:
+        digest: bytes = key if len(key) >= 16 else sha256(key).digest()
+        first: int = int.from_bytes(digest[:8], 'little')
+        second: int = int.from_bytes(digest[8:16], 'little') | 1
+        return [(first+i*second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: bytes) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @property
+    def fill_ratio(self) -> float:
+        return self.count/self.capacity
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def stats(self) -> dict:
+        return {
+            'count': self.count,
+            'capacity': self.capacity,
+            'fill_ratio': self.fill_ratio,
+            'error_rate': self.error_rate,
+            'bits': self.size,
+            'hash_count': self.hash_count
+        }
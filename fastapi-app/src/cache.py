@@ -0,0 +1,173 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from time import perf_counter, time
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+
+
+# handed to followers when the leader was cancelled, one of them repeats the load
+RELOAD: object = object()
+
+
+class TTLCache:
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        entry: tuple[float, Any] | None = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, expires_at: float | None = None) -> None:
+        if self.max_size <= 0:
+            return
+        deadline: float = time()+self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self._entries[key] = (deadline, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Any | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def clear(self) -> None:
+        ...
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self._cache: TTLCache = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def get(self, key: str) -> Any | None:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Any) -> None:
+        self._cache.set(key, value)
+
+    async def delete(self, key: str) -> None:
+        self._cache.delete(key)
+
+    async def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._cache),
+            'max_size': self._cache.max_size,
+            'ttl': self._cache.ttl
+        }
+
+
+class ReadThroughCache:
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any | None:
+        started: float = perf_counter()
+        value: Any | None = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            self.hit_seconds += perf_counter()-started
+            return value
+
+        self.misses += 1
+        while True:
+            future: asyncio.Future | None = self._inflight.get(key)
+            if future is not None:
+                value = await asyncio.shield(future)
+                if value is RELOAD:
+                    continue
+                break
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                value = await loader()
+                # an invalidation during the load drops the in-flight entry, its result is stale
+                if value is not None and self._inflight.get(key) is future:
+                    await self.backend.set(key, value)
+                future.set_result(value)
+            except asyncio.CancelledError:
+                # only the leader's request went away, a follower takes over the load
+                future.set_result(RELOAD)
+                raise
+            except BaseException as err:
+                future.set_exception(err)
+                future.exception()
+                raise
+            finally:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            break
+        self.miss_seconds += perf_counter()-started
+        return value
+
+    async def invalidate(self, key: str) -> None:
+        self._inflight.pop(key, None)
+        await self.backend.delete(key)
+
+    async def invalidate_all(self) -> None:
+        self._inflight.clear()
+        await self.backend.clear()
+
+    def stats(self) -> dict:
+        requests: int = self.hits+self.misses
+        return {
+            **self.backend.stats(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits/requests if requests else 0.0,
+            'avg_hit_seconds': self.hit_seconds/self.hits if self.hits else 0.0,
+            'avg_miss_seconds': self.miss_seconds/self.misses if self.misses else 0.0
+        }
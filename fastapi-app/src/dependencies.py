@@ -0,0 +1,35 @@
+from typing import Annotated, AsyncGenerator
+
+from fastapi import Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.database import DataBaseServer
+from config.settings import Settings
+
+
+# the app factory stores the settings on the app, handlers read them from there
+def get_app_settings(request: Request) -> Settings:
+    return request.app.state.settings
+
+def get_database(settings: Settings = Depends(get_app_settings)) -> DataBaseServer:
+    return settings.database
+
+async def get_session(database: DataBaseServer = Depends(get_database)) -> AsyncGenerator[AsyncSession, None]:
+    session: AsyncSession = database.session_maker()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+async def get_read_session(database: DataBaseServer = Depends(get_database)) -> AsyncGenerator[AsyncSession, None]:
+    session: AsyncSession = database.read_session_maker()()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+AppSettings = Annotated[Settings, Depends(get_app_settings)]
+AppDatabase = Annotated[DataBaseServer, Depends(get_database)]
+DBSession = Annotated[AsyncSession, Depends(get_session)]
+ReadDBSession = Annotated[AsyncSession, Depends(get_read_session)]
@@ -0,0 +1,200 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable
+import asyncio
+import logging
+import random
+import re
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, CursorResult, ExceptionContext, ExecutionContext
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.ext.asyncio.engine import AsyncEngine
+
+from config.settings import Settings, get_settings
+from loggers import init_logger
+from src.metrics import STATEMENT_NAME_OPTION, UNNAMED_STATEMENT
+
+
+EXPLAIN_STATEMENT_NAME: str = "explain"
+EXPLAINABLE_PREFIXES: tuple[str, ...] = ("select", "insert", "update", "delete", "with")
+# only plain reads are executed by ANALYZE, a WITH may hide a data-modifying CTE
+ANALYZE_PREFIXES: tuple[str, ...] = ("select",)
+LOCKING_CLAUSE: re.Pattern = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b", re.IGNORECASE)
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+explain_logger: logging = init_logger("diagnostics")
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    seconds: float = 0.0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class Diagnostics:
+    def __init__(self, enabled: bool, slow_ms: float, sample_rate: float, queue_size: int) -> None:
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.queue_size = queue_size
+        self.slow = 0
+        self.sampled = 0
+        self.explained = 0
+        self.failed = 0
+        self.dropped = 0
+        self._engine: AsyncEngine | None = None
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def configure(self, enabled: bool | None = None, slow_ms: float | None = None, sample_rate: float | None = None) -> dict:
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        logger.info(f'Diagnostics: enabled={self.enabled}, slow_ms={self.slow_ms}, sample_rate={self.sample_rate}')
+        return self.stats()
+
+    def instrument(self, engine: AsyncEngine) -> None:
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(
+            conn: Connection, cursor, statement: str, parameters, context: ExecutionContext, executemany: bool
+        ) -> None:
+            if self.enabled:
+                conn.info.setdefault("diagnostics_started", []).append(perf_counter())
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def after_cursor_execute(
+            conn: Connection, cursor, statement: str, parameters, context: ExecutionContext, executemany: bool
+        ) -> None:
+            # the mode may be switched on between the two events, then there is no start time
+            if conn.info.get("diagnostics_started"):
+                seconds: float = perf_counter()-conn.info["diagnostics_started"].pop()
+                name: str = context.execution_options.get(STATEMENT_NAME_OPTION, UNNAMED_STATEMENT)
+                self.observe(name, statement, parameters, seconds, executemany)
+
+        @event.listens_for(engine.sync_engine, "handle_error")
+        def handle_error(context: ExceptionContext) -> None:
+            if context.connection is not None and context.connection.info.get("diagnostics_started"):
+                context.connection.info["diagnostics_started"].pop()
+
+    def observe(self, name: str, statement: str, parameters, seconds: float, executemany: bool) -> None:
+        stats: RequestStats | None = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += seconds
+        if seconds*1000 < self.slow_ms or name == EXPLAIN_STATEMENT_NAME:
+            return
+        self.slow += 1
+        if executemany or self._queue is None or not statement.lstrip().lower().startswith(EXPLAINABLE_PREFIXES):
+            return
+        if random.random() >= self.sample_rate:
+            return
+        self.sampled += 1
+        try:
+            self._queue.put_nowait((name, statement, parameters, seconds))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self, engine: AsyncEngine) -> None:
+        if self._task is None:
+            self._engine = engine
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._queue = None
+
+    async def _run(self) -> None:
+        while True:
+            name, statement, parameters, seconds = await self._queue.get()
+            try:
+                plan: str = await self._explain(statement, parameters)
+            except Exception as err:
+                # a dropped connection surfaces as a raw driver error, the worker has to outlive it
+                self.failed += 1
+                logger.error(f'Explain statement {name!r}: {err!r}')
+                continue
+            self.explained += 1
+            # bind values carry tokens, password hashes and logins, only the statement text is logged
+            explain_logger.info(f'Slow statement {name!r} took {seconds*1000:.1f} ms\n{statement}\n{plan}')
+
+    async def _explain(self, statement: str, parameters) -> str:
+        # ANALYZE runs the statement, writes and locking reads would take row locks next to user
+        # traffic, so they only get the estimated plan; the transaction is rolled back either way
+        analyze: bool = statement.lstrip().lower().startswith(ANALYZE_PREFIXES) and not LOCKING_CLAUSE.search(statement)
+        options: str = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        async with self._engine.connect() as connection:
+            connection: AsyncConnection = await connection.execution_options(
+                **{ STATEMENT_NAME_OPTION: EXPLAIN_STATEMENT_NAME }
+            )
+            await connection.begin()
+            try:
+                result: CursorResult = await connection.exec_driver_sql(
+                    f"EXPLAIN ({options}) {statement}", parameters
+                )
+                return "\n".join(row[0] for row in result)
+            finally:
+                await connection.rollback()
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'slow_ms': self.slow_ms,
+            'sample_rate': self.sample_rate,
+            'slow': self.slow,
+            'sampled': self.sampled,
+            'explained': self.explained,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize() if self._queue is not None else 0
+        }
+
+
+diagnostics: Diagnostics = Diagnostics(
+    enabled=settings.diagnostics_enabled,
+    slow_ms=settings.diagnostics_slow_ms,
+    sample_rate=settings.diagnostics_sample_rate,
+    queue_size=settings.diagnostics_queue_size
+)
+
+
+class DiagnosticsMiddleware:
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not diagnostics.enabled:
+            await self.app(scope, receive, send)
+            return
+        started: float = perf_counter()
+        stats: RequestStats = RequestStats()
+        token = request_stats.set(stats)
+
+        async def send_wrapper(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                timing: str = (
+                    f'db;dur={stats.seconds*1000:.2f};desc="{stats.queries} queries", '
+                    f'app;dur={(perf_counter()-started)*1000:.2f}'
+                )
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_stats.reset(token)
@@ -0,0 +1,108 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request, status
+
+from config.settings import Settings, get_settings
+from src.metrics import login_throttled
+from src.ratelimit import TokenBucketLimiter, retry_after_header
+
+
+settings: Settings = get_settings()
+
+
+class LoginThrottledError(HTTPException):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, retry later",
+            headers=retry_after_header(retry_after)
+        )
+
+
+class LoginOverloadedError(HTTPException):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Login service is overloaded, retry later",
+            headers=retry_after_header(retry_after)
+        )
+
+
+class LoginAdmission:
+    def __init__(
+        self,
+        login_limiter: TokenBucketLimiter,
+        ip_limiter: TokenBucketLimiter,
+        concurrency: int,
+        queue_timeout: float
+    ) -> None:
+        self.login_limiter = login_limiter
+        self.ip_limiter = ip_limiter
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+        self._slots: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+
+    def check(self, login: str, client_ip: str | None) -> None:
+        # the ip bucket is charged first so a spray over many logins still drains it
+        if client_ip is not None and (retry_after := self.ip_limiter.acquire(client_ip)):
+            login_throttled.inc("ip")
+            raise LoginThrottledError(retry_after)
+        if (retry_after := self.login_limiter.acquire(login.lower())):
+            login_throttled.inc("login")
+            raise LoginThrottledError(retry_after)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            login_throttled.inc("overload")
+            raise LoginOverloadedError(self.queue_timeout)
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'queue_timeout': self.queue_timeout,
+            'active': self.active,
+            'waiting': self.waiting,
+            'shed': self.shed,
+            'login_keys': len(self.login_limiter),
+            'login_throttled': self.login_limiter.throttled,
+            'ip_keys': len(self.ip_limiter),
+            'ip_throttled': self.ip_limiter.throttled
+        }
+
+
+def client_ip(request: Request) -> str | None:
+    return request.client.host if request.client else None
+
+
+login_admission: LoginAdmission = LoginAdmission(
+    login_limiter=TokenBucketLimiter(
+        rate=settings.login_rate_per_login,
+        burst=settings.login_burst_per_login,
+        max_keys=settings.login_rate_max_keys
+    ),
+    ip_limiter=TokenBucketLimiter(
+        rate=settings.login_rate_per_ip,
+        burst=settings.login_burst_per_ip,
+        max_keys=settings.login_rate_max_keys
+    ),
+    concurrency=settings.login_concurrency or settings.cpus_per_worker,
+    queue_timeout=settings.login_queue_timeout
+)
@@ -0,0 +1,36 @@
+from fastapi import Depends, HTTPException, status
+
+from config.settings import Settings, get_settings
+from src.diagnostics import diagnostics
+from src.handlers.user import login_required
+from src.invalidation import DIAGNOSTICS_EVENT, invalidation_bus
+from src.schemas import DiagnosticsUpdate
+
+
+settings: Settings = get_settings()
+
+
+def diagnostics_required(
+    user: dict = Depends(login_required)
+) -> dict:
+    if user.get('login') in settings.diagnostics_login_list:
+        return user
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Diagnostics are not allowed for this user"
+    )
+
+def apply_diagnostics(key: str) -> None:
+    enabled, slow_ms, sample_rate = key.split(",")
+    diagnostics.configure(enabled == "1", float(slow_ms), float(sample_rate))
+
+def _diagnostics_update(body: DiagnosticsUpdate) -> dict:
+    stats: dict = diagnostics.configure(body.enabled, body.slow_ms, body.sample_rate)
+    # the switch is applied locally and sent to the other workers, each keeps its own copy
+    invalidation_bus.publish(
+        DIAGNOSTICS_EVENT, f'{int(diagnostics.enabled)},{diagnostics.slow_ms},{diagnostics.sample_rate}'
+    )
+    return stats
+
+
+invalidation_bus.subscribe(DIAGNOSTICS_EVENT, apply_diagnostics)
@@ -1,15 +1,205 @@
+import asyncio
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from time import perf_counter
+from typing import Callable
+
 import bcrypt
+from fastapi import HTTPException, status
+
+from config.settings import Settings, get_settings
+from src.metrics import password_seconds
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:
+    PasswordHasher = None
+
+    # without argon2-cffi an argon2 hash fails in configured_argon2(), these only keep the except clauses valid
+    class VerificationError(Exception):
+        pass
+
+    class InvalidHashError(Exception):
+        pass
+
+
+BCRYPT_SCHEME: str = "bcrypt"
+ARGON2_SCHEME: str = "argon2id"
+ARGON2_PREFIX: bytes = b"$argon2"
+
+settings: Settings = get_settings()
+
+@lru_cache
+def argon2_hasher(time_cost: int, memory_cost: int, parallelism: int) -> PasswordHasher:
+    if PasswordHasher is None:
+        raise RuntimeError("Password scheme 'argon2id' requires the argon2-cffi package")
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+def configured_argon2() -> PasswordHasher:
+    return argon2_hasher(settings.argon2_time_cost, settings.argon2_memory_cost, settings.argon2_parallelism)
 
 def hash_password(
     password: str
 ) -> bytes:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    if settings.password_scheme == ARGON2_SCHEME:
+        return configured_argon2().hash(password).encode()
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=settings.bcrypt_rounds))
 
 def verify_password(
     password: str,
     hashed_password: bytes
 ) -> bool:
+    # stored hashes keep their own scheme and parameters, so old hashes verify after a config change
+    if hashed_password.startswith(ARGON2_PREFIX):
+        try:
+            return configured_argon2().verify(hashed_password.decode(), password)
+        except (VerificationError, InvalidHashError):
+            return False
     return bcrypt.checkpw(
         password=password.encode(),
         hashed_password=hashed_password
     )
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    is_argon2: bool = hashed_password.startswith(ARGON2_PREFIX)
+    if settings.password_scheme == ARGON2_SCHEME:
+        return not is_argon2 or configured_argon2().check_needs_rehash(hashed_password.decode())
+    # bcrypt hashes look like $2b$12$..., the cost is the second field
+    return is_argon2 or int(hashed_password.split(b"$")[2]) != settings.bcrypt_rounds
+
+
+class PasswordQueueFullError(HTTPException):
+    def __init__(self, max_pending: int) -> None:
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Password service is busy ({max_pending} requests pending), retry later",
+            headers={"Retry-After": "1"}
+        )
+
+
+class PasswordService:
+    def __init__(self, executor_type: str, max_workers: int, queue_size: int, scheme: str) -> None:
+        if executor_type not in ("thread", "process"):
+            raise ValueError(f"Unknown password executor type {executor_type!r}, expected 'thread' or 'process'")
+        if scheme not in (BCRYPT_SCHEME, ARGON2_SCHEME):
+            raise ValueError(f"Unknown password scheme {scheme!r}, expected {BCRYPT_SCHEME!r} or {ARGON2_SCHEME!r}")
+        self.scheme = scheme
+        self.rehashed = 0
+        self.executor_type = executor_type
+        self.max_workers = max_workers
+        self.max_pending = max_workers + queue_size
+        self.pending = 0
+        self._executor: Executor | None = None
+
+    def start(self) -> None:
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _run(self, func: Callable, *args):
+        if self._executor is None:
+            raise RuntimeError("Password service is not started, call start() on application startup")
+        if self.pending >= self.max_pending:
+            raise PasswordQueueFullError(self.max_pending)
+        self.pending += 1
+        try:
+            with password_seconds.time(func.__name__):
+                return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            'executor': self.executor_type,
+            'scheme': self.scheme,
+            'bcrypt_rounds': settings.bcrypt_rounds,
+            'rehashed': self.rehashed,
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending
+        }
+
+    async def hash_password(self, password: str) -> bytes:
+        return await self._run(hash_password, password)
+
+    async def verify_password(self, password: str, hashed_password: bytes) -> bool:
+        return await self._run(verify_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        return needs_rehash(hashed_password)
+
+    async def hash_passwords(self, passwords: list[str]) -> list[bytes]:
+        # one job per password and at most half of the workers at a time, so a login queues
+        # behind a few single hashes instead of whole chunks of an import
+        lanes: int = max(1, self.max_workers//2)
+        hashed: list[bytes] = []
+        for i in range(0, len(passwords), lanes):
+            hashed.extend(await asyncio.gather(*[
+                self._run(hash_password, password) for password in passwords[i:i+lanes]
+            ]))
+        return hashed
+
+
+password_service: PasswordService = PasswordService(
+    executor_type=settings.password_executor,
+    max_workers=settings.password_workers or settings.cpus_per_worker,
+    queue_size=settings.password_queue_size,
+    scheme=settings.password_scheme
+)
+
+
+def calibration_verifier(cost: int, password: str) -> Callable[[], object]:
+    if settings.password_scheme == ARGON2_SCHEME:
+        hasher: PasswordHasher = argon2_hasher(cost, settings.argon2_memory_cost, settings.argon2_parallelism)
+        return partial(hasher.verify, hasher.hash(password), password)
+    hashed: bytes = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=cost))
+    return partial(bcrypt.checkpw, password.encode(), hashed)
+
+def calibrate(target_seconds: float, samples: int) -> dict:
+    # bcrypt cost is exponential and argon2 time_cost linear, so stop at the first cost over target
+    if settings.password_scheme == ARGON2_SCHEME:
+        parameter, candidates = "ARGON2_TIME_COST", range(1, 21)
+    else:
+        parameter, candidates = "BCRYPT_ROUNDS", range(4, 32)
+    recommended: dict = {}
+    measured: list[dict] = []
+    for cost in candidates:
+        verify: Callable[[], object] = calibration_verifier(cost, "calibration-password")
+        timings: list[float] = []
+        for _ in range(samples):
+            started: float = perf_counter()
+            verify()
+            timings.append(perf_counter()-started)
+        seconds: float = sorted(timings)[len(timings)//2]
+        measured.append({ 'cost': cost, 'verify_ms': seconds*1000 })
+        if seconds > target_seconds:
+            break
+        recommended = { parameter: cost, 'verify_ms': seconds*1000 }
+    return {
+        'scheme': settings.password_scheme,
+        'target_ms': target_seconds*1000,
+        'recommended': recommended,
+        'measured': measured
+    }
+
+def parse_args() -> Namespace:
+    parser: ArgumentParser = ArgumentParser(description="Pick the highest password hashing cost under a target verify latency")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="target verify latency per password")
+    parser.add_argument("--samples", type=int, default=3, help="verifications measured per cost")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments: Namespace = parse_args()
+    report: dict = calibrate(arguments.target_ms/1000, arguments.samples)
+    for row in report['measured']:
+        print(f"cost {row['cost']:>2}: verify {row['verify_ms']:9.2f} ms")
+    print(f"{report['scheme']} under {report['target_ms']:.0f} ms: {report['recommended'] or 'none, even the lowest cost is slower'}")
@@ -0,0 +1,176 @@
+from datetime import datetime
+import asyncio
+import logging
+
+from sqlalchemy import Result, Select, Update, select, update
+from sqlalchemy.dialects.postgresql import Insert, insert
+
+from config.database import DataBaseServer
+from config.settings import Settings, get_settings
+from loggers import init_logger
+from src.bloom import BloomFilter
+from src.dependencies import DBSession
+from src.handlers.token import token_cache, token_digest, token_writer
+from src.invalidation import REVOKE_EVENT, invalidation_bus
+from src.models import Tokens
+
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+
+
+class RevocationIndex:
+    def __init__(self, database: DataBaseServer, capacity: int, error_rate: float, rebuild_interval: float) -> None:
+        self.database = database
+        self.bloom: BloomFilter = BloomFilter(capacity=capacity, error_rate=error_rate)
+        self.rebuild_interval = rebuild_interval
+        self.checks = 0
+        self.positives = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+        self._loaded = 0
+        self._loading: list[bytes] | None = None
+        self._rebuild: asyncio.Event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._rebuild = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._rebuild.wait(), self.rebuild_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._rebuild.clear()
+            try:
+                # expired hashes only leave the filter with a rebuild from the live revoked set
+                await self.load()
+                self.rebuilds += 1
+            except Exception as err:
+                # a dropped connection surfaces as a raw driver error, the job has to outlive it
+                logger.error(f'Rebuild revoked tokens: {err!r}')
+
+    async def load(self) -> None:
+        bloom: BloomFilter = BloomFilter(capacity=self.bloom.capacity, error_rate=self.bloom.error_rate)
+        # revocations arriving while the rows stream may miss the snapshot, they are replayed on the new filter
+        self._loading = []
+        try:
+            async with self.database.session_maker() as session:
+                query: Select = select(Tokens.token_hash).\
+                    where(Tokens.is_active.is_(False), Tokens.expires_at > datetime.now()).\
+                    execution_options(metric_name='revocation_load')
+                result = await session.stream_scalars(query)
+                async for token_hash in result:
+                    bloom.add(token_hash)
+            for token_hash in self._loading:
+                bloom.add(token_hash)
+        finally:
+            self._loading = None
+        self.bloom = bloom
+        self._loaded = bloom.count
+        logger.info(f'Load revoked tokens: {bloom.count}')
+        if bloom.fill_ratio > 1:
+            logger.warning(f'Revoked tokens exceed REVOCATION_CAPACITY={bloom.capacity}, the false positive rate is above the target')
+
+    def add(self, token_hash: bytes) -> None:
+        self.bloom.add(token_hash)
+        if self._loading is not None:
+            self._loading.append(token_hash)
+        elif self.bloom.fill_ratio > 1 and self._loaded <= self.bloom.capacity:
+            # past its capacity the false positive rate climbs above the target, a rebuild drops the
+            # expired hashes; when the live set alone is too large a rebuild does not help
+            self._rebuild.set()
+
+    async def is_revoked(self, token: str | bytes) -> bool:
+        self.checks += 1
+        token_hash: bytes = token_digest(token)
+        if token_hash not in self.bloom:
+            return False
+        self.positives += 1
+        async with self.database.session_maker() as session:
+            query: Select = select(Tokens.is_active).where(Tokens.token_hash == token_hash).\
+                execution_options(metric_name='revocation_check')
+            result: Result = await session.execute(query)
+            is_active: bool | None = result.scalar_one_or_none()
+        if is_active is False:
+            return True
+        self.false_positives += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            **self.bloom.stats(),
+            'checks': self.checks,
+            'positives': self.positives,
+            'false_positives': self.false_positives,
+            'rebuild_interval': self.rebuild_interval,
+            'rebuilds': self.rebuilds
+        }
+
+
+revocation_index: RevocationIndex = RevocationIndex(
+    database=settings.database,
+    capacity=settings.revocation_capacity,
+    error_rate=settings.revocation_error_rate,
+    rebuild_interval=settings.revocation_rebuild_interval
+)
+
+def apply_revocation(key: str) -> None:
+    token_hash: bytes = bytes.fromhex(key)
+    revocation_index.add(token_hash)
+    token_cache.delete(token_hash)
+
+invalidation_bus.subscribe(REVOKE_EVENT, apply_revocation)
+invalidation_bus.on_resync(revocation_index.load)
+
+async def _token_revoke(
+    token: str,
+    payload: dict,
+    revoke_all: bool,
+    session: DBSession
+) -> dict:
+    token_hash: bytes = token_digest(token)
+    # tokens of the session may still sit in the write-behind buffer, the update below has to see them
+    await token_writer.drain()
+    async with session.begin():
+        # access tokens issued by /token/refresh/ are never stored, so upsert it as revoked
+        query: Insert = insert(Tokens).values(
+            user_id=payload.get('user_id'),
+            token=token,
+            token_hash=token_hash,
+            expires_at=datetime.fromtimestamp(payload.get('exp')),
+            is_active=False,
+            session_id=payload.get('sid')
+        ).on_conflict_do_update(index_elements=[Tokens.token_hash, Tokens.expires_at], set_={ 'is_active': False }).\
+            execution_options(metric_name='token_revoke')
+        await session.execute(query)
+        revoked: list[bytes] = [token_hash]
+        if revoke_all or payload.get('sid'):
+            # the whole session goes, including the refresh token issued with this access token
+            query: Update = update(Tokens).\
+                where(Tokens.user_id == payload.get('user_id'), Tokens.is_active.is_not(False), Tokens.expires_at > datetime.now())
+            if not revoke_all:
+                query = query.where(Tokens.session_id == payload.get('sid'))
+            query = query.\
+                values(is_active=False).\
+                returning(Tokens.token_hash).\
+                execution_options(metric_name='token_revoke')
+            result: Result = await session.execute(query)
+            revoked.extend(result.scalars().all())
+    for revoked_hash in revoked:
+        revocation_index.add(revoked_hash)
+        invalidation_bus.publish(REVOKE_EVENT, revoked_hash.hex())
+    logger.info(f'Revoke {len(revoked)} token(s) of user {payload.get("user_id")!r}')
+    return { 'revoked': len(revoked) }
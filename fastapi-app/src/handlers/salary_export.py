@@ -0,0 +1,103 @@
+from datetime import datetime
+from io import StringIO
+from typing import AsyncIterator, Literal
+from uuid import UUID
+import csv
+import json
+import logging
+
+from fastapi import Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncResult
+
+from config.settings import Settings, get_settings
+from loggers import init_logger
+from src.handlers.user import login_required
+from src.handlers.user_import import CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE
+from src.models import Employees
+from src.queries import SALARY_EXPORT
+
+
+EXPORT_COLUMNS: tuple[str, ...] = ('employee_id', 'user_id', 'login', 'full_name', 'salary', 'next_raise_date')
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+
+
+def salary_export_required(
+    user: dict = Depends(login_required)
+) -> dict:
+    if user.get('login') in settings.salary_export_login_list:
+        return user
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Salary export is not allowed for this user"
+    )
+
+def export_page(
+    after: UUID | None,
+    raise_from: datetime | None,
+    raise_to: datetime | None,
+    page_size: int
+) -> Select:
+    query: Select = SALARY_EXPORT.limit(page_size)
+    if after is not None:
+        query = query.where(Employees.id > after)
+    if raise_from is not None:
+        query = query.where(Employees.next_raise_date >= raise_from)
+    if raise_to is not None:
+        query = query.where(Employees.next_raise_date < raise_to)
+    return query
+
+async def iter_salary_rows(
+    after: UUID | None,
+    raise_from: datetime | None,
+    raise_to: datetime | None
+) -> AsyncIterator[list[dict]]:
+    page_size: int = settings.salary_export_page_size
+    while True:
+        # one short read per page instead of a transaction held open for the whole export
+        async with settings.database.read_session_maker()() as session:
+            query: Select = export_page(after, raise_from, raise_to, page_size).\
+                execution_options(yield_per=settings.salary_export_fetch_size)
+            result: AsyncResult = await session.stream(query)
+            fetched: int = 0
+            async for partition in result.mappings().partitions():
+                fetched += len(partition)
+                after = partition[-1]['cursor']
+                yield [{ column: row[column] for column in EXPORT_COLUMNS } for row in partition]
+        if fetched < page_size:
+            return
+
+async def iter_ndjson(rows: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    async for partition in rows:
+        yield ''.join(json.dumps(row, default=str)+'\n' for row in partition).encode()
+
+async def iter_csv(rows: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    buffer: StringIO = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    async for partition in rows:
+        writer.writerows(partition)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def _salary_export(
+    user: dict,
+    format: Literal['ndjson', 'csv'],
+    after: UUID | None,
+    raise_from: datetime | None,
+    raise_to: datetime | None
+) -> StreamingResponse:
+    logger.info(
+        f'Salary export by {user.get("login")!r}: format={format}, after={after}, '
+        f'raise_from={raise_from}, raise_to={raise_to}'
+    )
+    rows: AsyncIterator[list[dict]] = iter_salary_rows(after, raise_from, raise_to)
+    if format == 'csv':
+        return StreamingResponse(iter_csv(rows), media_type=CSV_MEDIA_TYPE)
+    return StreamingResponse(iter_ndjson(rows), media_type=NDJSON_MEDIA_TYPE)
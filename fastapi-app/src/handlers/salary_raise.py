@@ -0,0 +1,268 @@
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from time import perf_counter
+from uuid import UUID, uuid4
+import asyncio
+import json
+import logging
+import math
+
+from sqlalchemy import UUID as UUIDType, DateTime, Float, Insert, Integer, Result, Select, TextClause, Update, bindparam, func, insert, select, text, update
+
+from config.database import DataBaseServer
+from config.settings import Settings, get_settings
+from loggers import init_logger
+from src.handlers.user import salary_cache
+from src.invalidation import ALL_KEYS, SALARY_EVENT, invalidation_bus
+from src.models import Employees, SalaryRaiseRuns
+
+
+MIN_EMPLOYEE_ID: UUID = UUID(int=0)
+SALARY_RAISE_LOCK: str = "salary_raise"
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+
+# the next due employees in id order that this run has not raised yet
+DUE_EMPLOYEES: str = """
+    SELECT id, salary, next_raise_date
+    FROM employees
+    WHERE next_raise_date <= :cutoff AND id > :after
+        AND NOT EXISTS (SELECT 1 FROM salary_raises r WHERE r.run_id = :run_id AND r.employee_id = employees.id)
+    ORDER BY id
+    LIMIT :chunk_size
+"""
+# one chunk: lock the due employees, skipping rows held by user traffic,
+# raise them, roll next_raise_date forward and record the old and new values
+APPLY_RAISES: TextClause = text(f"""
+    WITH due AS ({DUE_EMPLOYEES}
+        FOR UPDATE SKIP LOCKED
+    ), raised AS (
+        UPDATE employees e
+        SET salary = round(e.salary * (1 + :percent / 100.0))::integer,
+            next_raise_date = e.next_raise_date + make_interval(months => :interval_months)
+        FROM due
+        WHERE e.id = due.id
+        RETURNING e.id, e.salary, e.next_raise_date
+    )
+    INSERT INTO salary_raises (run_id, employee_id, old_salary, new_salary, old_raise_date, new_raise_date)
+    SELECT :run_id, raised.id, due.salary, raised.salary, due.next_raise_date, raised.next_raise_date
+    FROM raised JOIN due ON due.id = raised.id
+    RETURNING employee_id
+""").bindparams(
+    bindparam('cutoff', type_=DateTime),
+    bindparam('after', type_=UUIDType(as_uuid=True)),
+    bindparam('chunk_size', type_=Integer),
+    bindparam('percent', type_=Float),
+    bindparam('interval_months', type_=Integer),
+    bindparam('run_id', type_=UUIDType(as_uuid=True))
+).execution_options(metric_name='salary_raise')
+# the same rows read without locks, the dry run times it instead of touching production rows
+SAMPLE_DUE: TextClause = text(DUE_EMPLOYEES).bindparams(
+    bindparam('cutoff', type_=DateTime),
+    bindparam('after', type_=UUIDType(as_uuid=True)),
+    bindparam('chunk_size', type_=Integer),
+    bindparam('run_id', type_=UUIDType(as_uuid=True))
+).execution_options(metric_name='salary_raise_due')
+
+
+class SalaryRaiser:
+    def __init__(
+        self,
+        database: DataBaseServer,
+        enabled: bool,
+        interval: float,
+        chunk_size: int,
+        percent: float,
+        interval_months: int,
+        lock_timeout: str
+    ) -> None:
+        self.database = database
+        self.enabled = enabled
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.percent = percent
+        self.interval_months = interval_months
+        self.lock_timeout = lock_timeout
+        self._set_lock_timeout: TextClause = text(f"SET LOCAL lock_timeout = '{lock_timeout}'")
+        self.runs = 0
+        self.raised_total = 0
+        self.last_run: dict = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # every worker schedules the job, the lock lets one of them run it at a time
+                async with self.database.advisory_lock(SALARY_RAISE_LOCK) as locked:
+                    if locked:
+                        await self.run_once()
+            except Exception as err:
+                # a dropped connection surfaces as a raw driver error, the job has to outlive it
+                logger.error(f'Apply salary raises: {err!r}')
+            await asyncio.sleep(self.interval)
+
+    async def _current_run(self) -> dict:
+        async with self.database.session_maker() as session:
+            async with session.begin():
+                query: Select = select(SalaryRaiseRuns.id, SalaryRaiseRuns.cutoff, SalaryRaiseRuns.last_employee_id, SalaryRaiseRuns.processed).\
+                    where(SalaryRaiseRuns.finished_at.is_(None)).\
+                    order_by(SalaryRaiseRuns.started_at).\
+                    limit(1)
+                result: Result = await session.execute(query)
+                if (run := result.mappings().fetchone()):
+                    logger.info(f'Resume salary raise run {str(run.get("id"))!r} after {run.get("processed")} rows')
+                    return dict(run)
+                now: datetime = datetime.now()
+                query: Insert = insert(SalaryRaiseRuns).\
+                    values(cutoff=now, started_at=now, processed=0).\
+                    returning(SalaryRaiseRuns.id, SalaryRaiseRuns.cutoff, SalaryRaiseRuns.last_employee_id, SalaryRaiseRuns.processed)
+                result = await session.execute(query)
+                return dict(result.mappings().one())
+
+    async def _apply_chunk(self, run: dict) -> tuple[int, bool]:
+        async with self.database.session_maker() as session:
+            async with session.begin():
+                await session.execute(self._set_lock_timeout)
+                result: Result = await session.execute(APPLY_RAISES, {
+                    'cutoff': run['cutoff'],
+                    'after': run['last_employee_id'] or MIN_EMPLOYEE_ID,
+                    'chunk_size': self.chunk_size,
+                    'percent': self.percent,
+                    'interval_months': self.interval_months,
+                    'run_id': run['id']
+                })
+                raised: list[UUID] = list(result.scalars().all())
+                finished: bool = False
+                if raised:
+                    run['last_employee_id'] = max(raised)
+                    run['processed'] += len(raised)
+                elif run['last_employee_id'] is not None:
+                    # rows skipped as locked stay behind the cursor, another sweep from the start picks
+                    # them up; employees raised in this run are excluded, so nobody is raised twice
+                    run['last_employee_id'] = None
+                else:
+                    # a sweep from the start found nothing left to raise
+                    finished = True
+                # progress is committed with the chunk, an interrupted run resumes after the last raised employee
+                query: Update = update(SalaryRaiseRuns).\
+                    where(SalaryRaiseRuns.id == run['id']).\
+                    values(
+                        last_employee_id=run['last_employee_id'],
+                        processed=run['processed'],
+                        finished_at=datetime.now() if finished else None
+                    )
+                await session.execute(query)
+        return len(raised), finished
+
+    async def run_once(self) -> dict:
+        started: float = perf_counter()
+        run: dict = await self._current_run()
+        raised: int = 0
+        chunks: int = 0
+        while True:
+            count, finished = await self._apply_chunk(run)
+            raised += count
+            chunks += 1
+            if count:
+                await salary_cache.invalidate_all()
+                invalidation_bus.publish(SALARY_EVENT, ALL_KEYS)
+            if finished:
+                break
+            await asyncio.sleep(0)
+        self.runs += 1
+        self.raised_total += raised
+        self.last_run = {
+            'run_id': str(run['id']),
+            'cutoff': run['cutoff'],
+            'finished_at': datetime.now(),
+            'seconds': perf_counter()-started,
+            'chunks': chunks,
+            'raised': raised
+        }
+        logger.info(f'Apply salary raises: {raised} employees in {chunks} chunks in {self.last_run["seconds"]:.3f}s')
+        return self.last_run
+
+    async def dry_run(self) -> dict:
+        cutoff: datetime = datetime.now()
+        async with self.database.session_maker() as session:
+            query: Select = select(func.count()).\
+                select_from(Employees).\
+                where(Employees.next_raise_date <= cutoff).\
+                execution_options(metric_name='salary_raise_due')
+            due: int = (await session.execute(query)).scalar_one()
+            sample_seconds: float = 0.0
+            if due:
+                # time the read side of one chunk, the writes are left out so no row is locked
+                started: float = perf_counter()
+                await session.execute(SAMPLE_DUE, {
+                    'cutoff': cutoff,
+                    'after': MIN_EMPLOYEE_ID,
+                    'chunk_size': self.chunk_size,
+                    'run_id': uuid4()
+                })
+                sample_seconds = perf_counter()-started
+        chunks: int = math.ceil(due/self.chunk_size)
+        return {
+            'cutoff': cutoff,
+            'due': due,
+            'chunk_size': self.chunk_size,
+            'chunks': chunks,
+            'sample_chunk_seconds': sample_seconds,
+            'estimated_seconds': chunks*sample_seconds
+        }
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'chunk_size': self.chunk_size,
+            'percent': self.percent,
+            'interval_months': self.interval_months,
+            'lock_timeout': self.lock_timeout,
+            'runs': self.runs,
+            'raised_total': self.raised_total,
+            'last_run': self.last_run
+        }
+
+
+salary_raiser: SalaryRaiser = SalaryRaiser(
+    database=settings.database,
+    enabled=settings.salary_raise_enabled,
+    interval=settings.salary_raise_interval,
+    chunk_size=settings.salary_raise_chunk_size,
+    percent=settings.salary_raise_percent,
+    interval_months=settings.salary_raise_interval_months,
+    lock_timeout=settings.salary_raise_lock_timeout
+)
+
+
+def parse_args() -> Namespace:
+    parser: ArgumentParser = ArgumentParser(description="Apply due salary raises in set-based chunks")
+    parser.add_argument("--dry-run", action="store_true", help="report how many employees are due and the estimated runtime")
+    return parser.parse_args()
+
+async def main(args: Namespace) -> dict:
+    settings.database.connect(settings.pool_options)
+    try:
+        if args.dry_run:
+            return await salary_raiser.dry_run()
+        return await salary_raiser.run_once()
+    finally:
+        await settings.database.disconnect()
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(main(parse_args())), indent=2, default=str))
@@ -1,15 +1,25 @@
 from datetime import UTC, datetime, timedelta
-from typing import Annotated, Callable
+from functools import lru_cache
+from hashlib import sha256
+from time import perf_counter
+from uuid import uuid4
+import asyncio
 import logging
 
 import jwt
-from fastapi import Depends, Response, status
-from sqlalchemy import Result, insert, exc
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import Response, status
+from sqlalchemy import Insert, Result, Select, insert, exc, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.sql.dml import ReturningInsert
 
-from config.settings import Settings
-from loggers import init_logger
+from config.database import DataBaseServer
+from config.settings import Settings, get_settings
+from loggers import HOT_PATH, init_logger
+from src.cache import TTLCache
+from src.dependencies import DBSession
+from src.invalidation import invalidation_bus
+from src.keys import JWTKey, KeyManager
+from src.metrics import jwt_seconds
 from src.models import Tokens
 from src.schemas import TokenAfterCreate, TokenCreate
 
@@ -18,18 +28,30 @@ TOKEN_TYPE_FIELD: str = "type"
 ACCESS_TOKEN_TYPE: str = "access"
 REFRESH_TOKEN_TYPE: str = "refresh"
 
-settings: Settings = Settings()
-session: Callable = settings.database.get_session_async
-DBSession = Annotated[AsyncSession, Depends(session)]
+settings: Settings = get_settings()
 logger: logging = init_logger("app")
+token_cache: TTLCache = TTLCache(max_size=settings.token_cache_size, ttl=settings.token_cache_ttl)
+
+# revoked tokens are evicted by the revocation index, a resync drops everything
+invalidation_bus.on_resync(token_cache.clear)
+
+@lru_cache
+def get_key_manager() -> KeyManager:
+    return KeyManager.from_files(
+        algorithm=settings.algorithm,
+        private_key_file=settings.private_key_file,
+        public_key_file=settings.public_key_file,
+        previous_public_key_files=settings.previous_public_key_paths,
+        key_id=settings.key_id
+    )
 
 def encode_jwt(
     payload: dict,
-    private_key: str = settings.private_key_file.read_text(),
-    algorithm: str = settings.algorithm,
+    key: JWTKey | None = None,
     expire_minutes: int = settings.access_token_expire_minutes,
     expire_timedelta: timedelta | None = None
 ) -> str:
+    key = key or get_key_manager().signing_key
     current_datetime: datetime = datetime.now(UTC)
     to_encode: dict = payload.copy()
     if expire_timedelta:
@@ -40,32 +62,48 @@ def encode_jwt(
         iat=current_datetime,
         exp=expire
     )
-    encoded: str = jwt.encode(
-        to_encode,
-        private_key,
-        algorithm
-    )
+    with jwt_seconds.time("sign"):
+        encoded: str = jwt.encode(
+            to_encode,
+            key.private_key,
+            key.algorithm,
+            headers={ "kid": key.kid }
+        )
     return encoded
 
 def decode_jwt(
     token: str | bytes,
-    public_key: str = settings.public_key_file.read_text(),
-    algorithm: str = settings.algorithm
+    key: JWTKey | None = None
 ) -> dict:
-    decoded: dict = jwt.decode(
-        token,
-        public_key,
-        algorithms=[algorithm]
-    )
+    key = key or get_key_manager().verification_key(token)
+    with jwt_seconds.time("verify"):
+        decoded: dict = jwt.decode(
+            token,
+            key.public_key,
+            algorithms=[key.algorithm]
+        )
     return decoded
 
+def token_digest(token: str | bytes) -> bytes:
+    if isinstance(token, str):
+        token = token.encode()
+    return sha256(token).digest()
+
+def decode_jwt_cached(token: str | bytes) -> dict:
+    key: bytes = token_digest(token)
+    payload: dict | None = token_cache.get(key)
+    if payload is None:
+        payload = decode_jwt(token=token)
+        token_cache.set(key, payload, expires_at=payload.get('exp'))
+    return payload.copy()
+
 def create_jwt(
     token_type: str, 
     token_data: dict,
     expire_minutes: int = settings.access_token_expire_minutes,
     expire_timedelta: timedelta | None = None
 ) -> str:
-    jwt_payload: dict = { TOKEN_TYPE_FIELD: token_type }
+    jwt_payload: dict = { TOKEN_TYPE_FIELD: token_type, "jti": uuid4().hex }
     jwt_payload.update(token_data)
     return encode_jwt(
         payload=jwt_payload,
@@ -77,7 +115,8 @@ def create_access_token(user: dict) -> str:
     jwt_payload: dict = {
         "sub": user.get('user_id'),
         "user_id": user.get('user_id'),
-        "login": user.get('login')
+        "login": user.get('login'),
+        "sid": user.get('sid')
     }
     return create_jwt(
         token_type=ACCESS_TOKEN_TYPE,
@@ -88,7 +127,8 @@ def create_access_token(user: dict) -> str:
 def create_refresh_token(user: dict) -> str:
     jwt_payload: dict = {
         "sub": user.get('user_id'),
-        "user_id": user.get('user_id')
+        "user_id": user.get('user_id'),
+        "sid": user.get('sid')
     }
     return create_jwt(
         token_type=REFRESH_TOKEN_TYPE,
@@ -96,24 +136,185 @@ def create_refresh_token(user: dict) -> str:
         expire_timedelta=timedelta(days=settings.refresh_token_expire_days)
     )
 
+def token_row(body: TokenCreate) -> dict:
+    row: dict = body.model_dump(exclude_none=True)
+    row['token_hash'] = token_digest(row.get('token'))
+    return row
+
 async def save_token_in_db(
     body: TokenCreate,
     session: DBSession
 ) -> TokenAfterCreate:
-    body: dict = body.model_dump(exclude_none=True)
+    body: dict = token_row(body)
     try:
         async with session.begin():
             query: ReturningInsert = insert(Tokens).values(**body).\
-                returning(Tokens.id, Tokens.user_id, Tokens.token, Tokens.expires_at, Tokens.is_active)
+                returning(Tokens.id, Tokens.user_id, Tokens.token, Tokens.expires_at, Tokens.is_active).\
+                execution_options(metric_name='save_token')
             result: Result = await session.execute(query)
             token: dict = dict(result.mappings().one())
 
-            logger.info(f'Save token with id {str(token.get("id"))!r}')
-            
-            return token
+            logger.info('Save token with id %r', str(token.get("id")), extra=HOT_PATH)
+        return token
     except exc.SQLAlchemyError as err:
         logger.error(f'Save token: {err.args[0]}')
         return Response(
             content={ 'status_code': 500, 'error': err.args[0] }, 
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+class TokenWriter:
+    def __init__(
+        self,
+        database: DataBaseServer,
+        enabled: bool,
+        batch_size: int,
+        flush_interval: float,
+        buffer_size: int
+    ) -> None:
+        self.database = database
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_seconds = 0.0
+        self._running = False
+        self._queue: asyncio.Queue | None = None
+        self._full: asyncio.Event | None = None
+        self._flushed: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.buffer_size)
+            self._full = asyncio.Event()
+            self._flushed = asyncio.Event()
+            self._running = True
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._running = False
+            # a full buffer makes room as the writer drains it, unless the writer is gone
+            sentinel: asyncio.Future = asyncio.ensure_future(self._queue.put(None))
+            await asyncio.wait((sentinel, self._task), return_when=asyncio.FIRST_COMPLETED)
+            sentinel.cancel()
+            self._full.set()
+            await asyncio.wait((self._task,))
+            self._task = None
+
+    def put(self, body: TokenCreate) -> bool:
+        if not self._running:
+            return False
+        try:
+            self._queue.put_nowait(token_row(body))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+        return True
+
+    async def drain(self) -> None:
+        # rows are flushed in order, so everything enqueued so far is in the database
+        # once that many rows have been written or failed
+        target: int = self.enqueued
+        while self._running and self.written+self.failed < target:
+            self._flushed.clear()
+            self._full.set()
+            await self._flushed.wait()
+
+    async def _run(self) -> None:
+        try:
+            await self._drain()
+        finally:
+            # callers fall back to the synchronous insert once the writer is gone
+            self._running = False
+            self._flushed.set()
+
+    async def _drain(self) -> None:
+        stopping: bool = False
+        while not stopping:
+            row: dict | None = await self._queue.get()
+            if row is None:
+                break
+            if self._queue.qsize() < self.batch_size-1:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch: list[dict] = [row]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        started: float = perf_counter()
+        try:
+            async with self.database.session_maker() as session:
+                async with session.begin():
+                    query: Insert = pg_insert(Tokens).values(batch).\
+                        on_conflict_do_nothing(index_elements=[Tokens.token_hash, Tokens.expires_at]).\
+                        execution_options(metric_name='save_token_batch')
+                    await session.execute(query)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as err:
+            # a dropped connection surfaces as a raw driver error, the writer has to outlive it
+            self.failed += len(batch)
+            logger.error(f'Save tokens batch of {len(batch)}: {err!r}')
+        self.last_flush_seconds = perf_counter()-started
+        self._flushed.set()
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'buffered': self._queue.qsize() if self._queue is not None else 0,
+            'buffer_size': self.buffer_size,
+            'enqueued': self.enqueued,
+            'rejected': self.rejected,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_flush_seconds': self.last_flush_seconds
+        }
+
+
+token_writer: TokenWriter = TokenWriter(
+    database=settings.database,
+    enabled=settings.token_write_behind,
+    batch_size=settings.token_batch_size,
+    flush_interval=settings.token_flush_interval,
+    buffer_size=settings.token_buffer_size
+)
+
+async def store_token(
+    body: TokenCreate,
+    session: DBSession
+) -> None:
+    if not token_writer.put(body):
+        await save_token_in_db(body, session)
+
+async def get_token_from_db(
+    token: str | bytes,
+    session: DBSession
+) -> dict | None:
+    query: Select = select(Tokens.id, Tokens.user_id, Tokens.expires_at, Tokens.is_active).\
+        where(Tokens.token_hash == token_digest(token)).\
+        execution_options(metric_name='token_get')
+    result: Result = await session.execute(query)
+    if (response:= result.mappings().fetchone()):
+        return dict(response)
+    return None
@@ -0,0 +1,227 @@
+from datetime import date, datetime, timedelta
+from time import perf_counter
+import asyncio
+import logging
+
+from sqlalchemy import Result, TextClause, exc, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config.database import DataBaseServer
+from config.settings import Settings, get_settings
+from loggers import init_logger
+
+
+PARTITION_PREFIX: str = "tokens_p"
+PARTITION_DATE_FORMAT: str = "%Y%m%d"
+REAPER_LOCK: str = "token_reaper"
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+
+PURGE_EXPIRED_TOKENS: TextClause = text("""
+    DELETE FROM tokens
+    WHERE (id, expires_at) IN (
+        SELECT id, expires_at FROM tokens WHERE expires_at < :purge_before LIMIT :batch_size
+    )
+""").execution_options(metric_name='token_reap')
+TOKEN_PARTITIONS: TextClause = text("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'tokens'::regclass AND c.relname LIKE 'tokens\\_p%'
+""")
+# partitions left half detached by an interrupted DETACH ... CONCURRENTLY
+DETACH_PENDING: TextClause = text("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'tokens'::regclass AND i.inhdetachpending
+""")
+# tokens outside every daily partition, a day found here blocks PARTITION OF until its rows move out
+DEFAULT_ROWS: TextClause = text("""
+    SELECT expires_at::date AS day, count(*) AS rows
+    FROM tokens_default
+    GROUP BY 1
+""").execution_options(metric_name='token_reap')
+SET_LOCK_TIMEOUT: TextClause = text("SET LOCAL lock_timeout = '2s'")
+SET_SESSION_LOCK_TIMEOUT: TextClause = text("SET lock_timeout = '2s'")
+RESET_LOCK_TIMEOUT: TextClause = text("RESET lock_timeout")
+
+
+def partition_name(day: date) -> str:
+    return f'{PARTITION_PREFIX}{day.strftime(PARTITION_DATE_FORMAT)}'
+
+
+class TokenReaper:
+    def __init__(
+        self,
+        database: DataBaseServer,
+        enabled: bool,
+        interval: float,
+        batch_size: int,
+        retention: timedelta,
+        days_ahead: int
+    ) -> None:
+        self.database = database
+        self.enabled = enabled
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self.days_ahead = days_ahead
+        self.runs = 0
+        self.purged_total = 0
+        self.last_run: dict = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # every worker schedules the job, the lock lets one of them run it at a time
+                async with self.database.advisory_lock(REAPER_LOCK) as locked:
+                    if locked:
+                        await self.run_once()
+            except Exception as err:
+                # a dropped connection surfaces as a raw driver error, the job has to outlive it
+                logger.error(f'Reap tokens: {err!r}')
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        started: float = perf_counter()
+        purge_before: datetime = datetime.now()-self.retention
+        default_rows: dict[date, int] = await self._default_rows()
+        created: list[str] = await self._create_partitions(default_rows)
+        dropped: list[str] = await self._drop_partitions(purge_before)
+        purged: int = await self._purge_rows(purge_before)
+        self.runs += 1
+        self.purged_total += purged
+        self.last_run = {
+            'finished_at': datetime.now(),
+            'seconds': perf_counter()-started,
+            'purged': purged,
+            'partitions_created': created,
+            'partitions_dropped': dropped,
+            'default_rows': sum(default_rows.values())
+        }
+        logger.info(f'Reap tokens: {purged} rows purged, {len(dropped)} partitions dropped in {self.last_run["seconds"]:.3f}s')
+        return self.last_run
+
+    async def _partitions(self) -> list[str]:
+        async with self.database.session_maker() as session:
+            result: Result = await session.execute(TOKEN_PARTITIONS)
+            return list(result.scalars().all())
+
+    async def _default_rows(self) -> dict[date, int]:
+        async with self.database.session_maker() as session:
+            result: Result = await session.execute(DEFAULT_ROWS)
+            default_rows: dict[date, int] = { row.day: row.rows for row in result }
+        if default_rows:
+            logger.warning(f'Reap tokens: {sum(default_rows.values())} rows in tokens_default, days {sorted(default_rows)}')
+        return default_rows
+
+    async def _create_partitions(self, default_rows: dict[date, int]) -> list[str]:
+        existing: set[str] = set(await self._partitions())
+        created: list[str] = []
+        today: date = date.today()
+        for offset in range(self.days_ahead+1):
+            day: date = today+timedelta(days=offset)
+            name: str = partition_name(day)
+            if name in existing:
+                continue
+            try:
+                bounds: str = f"FROM ('{day.isoformat()}') TO ('{(day+timedelta(days=1)).isoformat()}')"
+                async with self.database.session_maker() as session:
+                    async with session.begin():
+                        await session.execute(SET_LOCK_TIMEOUT)
+                        if day in default_rows:
+                            # the rows of the day leave tokens_default in the same transaction,
+                            # otherwise the default partition would violate the new bounds
+                            await session.execute(text("CREATE TEMP TABLE tokens_moving (LIKE tokens) ON COMMIT DROP"))
+                            await session.execute(text(
+                                f"WITH moved AS (DELETE FROM tokens_default WHERE expires_at >= '{day.isoformat()}' "
+                                f"AND expires_at < '{(day+timedelta(days=1)).isoformat()}' RETURNING *) "
+                                f"INSERT INTO tokens_moving SELECT * FROM moved"
+                            ))
+                        await session.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF tokens FOR VALUES {bounds}"))
+                        if day in default_rows:
+                            await session.execute(text("INSERT INTO tokens SELECT * FROM tokens_moving"))
+                created.append(name)
+            except exc.SQLAlchemyError as err:
+                # IF NOT EXISTS does not cover a creator that commits in between, its partition is just as good
+                if name not in await self._partitions():
+                    logger.error(f'Create token partition {name!r}: {err.args[0]}')
+        return created
+
+    async def _drop_partitions(self, purge_before: datetime) -> list[str]:
+        dropped: list[str] = []
+        async with self.database.session_maker() as session:
+            result: Result = await session.execute(DETACH_PENDING)
+            pending: set[str] = set(result.scalars().all())
+        for name in await self._partitions():
+            try:
+                day: date = datetime.strptime(name.removeprefix(PARTITION_PREFIX), PARTITION_DATE_FORMAT).date()
+            except ValueError:
+                continue
+            if datetime.combine(day+timedelta(days=1), datetime.min.time()) > purge_before:
+                continue
+            try:
+                # a concurrent detach only takes SHARE UPDATE EXCLUSIVE on tokens, so token reads and writes
+                # go on; it cannot run inside a transaction, and one interrupted half way is finalized instead
+                mode: str = "FINALIZE" if name in pending else "CONCURRENTLY"
+                async with self.database.engine.connect() as connection:
+                    connection: AsyncConnection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+                    await connection.execute(SET_SESSION_LOCK_TIMEOUT)
+                    try:
+                        await connection.execute(text(f"ALTER TABLE tokens DETACH PARTITION {name} {mode}"))
+                        await connection.execute(text(f"DROP TABLE {name}"))
+                    finally:
+                        await connection.execute(RESET_LOCK_TIMEOUT)
+                dropped.append(name)
+            except exc.SQLAlchemyError as err:
+                logger.error(f'Drop token partition {name!r}: {err.args[0]}')
+        return dropped
+
+    async def _purge_rows(self, purge_before: datetime) -> int:
+        purged: int = 0
+        while True:
+            async with self.database.session_maker() as session:
+                async with session.begin():
+                    result: Result = await session.execute(
+                        PURGE_EXPIRED_TOKENS, { 'purge_before': purge_before, 'batch_size': self.batch_size }
+                    )
+            purged += result.rowcount
+            if result.rowcount < self.batch_size:
+                return purged
+            await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'interval': self.interval,
+            'runs': self.runs,
+            'purged_total': self.purged_total,
+            'last_run': self.last_run
+        }
+
+
+token_reaper: TokenReaper = TokenReaper(
+    database=settings.database,
+    enabled=settings.token_reaper_enabled,
+    interval=settings.token_reaper_interval,
+    batch_size=settings.token_reaper_batch_size,
+    retention=timedelta(hours=settings.token_retention_hours),
+    # refresh tokens are stored too, their partitions must exist before they are issued
+    days_ahead=max(settings.token_partition_days_ahead, settings.refresh_token_expire_days+1)
+)
@@ -1,64 +1,73 @@
 from datetime import datetime
 from functools import partial
 import logging
-from typing import Annotated, Callable
+from uuid import uuid4
 
-from fastapi import Depends, HTTPException, Response, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy import UUID, Cast, Insert, Result, Select, String, insert, exc, select
+from sqlalchemy import UUID, Result, exc
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.sql.dml import ReturningInsert
 from jwt.exceptions import InvalidTokenError
 
-from config.settings import Settings
-from loggers import init_logger
-from src.handlers.token import ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE, TOKEN_TYPE_FIELD, create_access_token, create_refresh_token, decode_jwt, save_token_in_db
-from src.handlers.password import hash_password, verify_password
-from src.models import Employees, Users
+from config.settings import Settings, get_settings
+from loggers import HOT_PATH, init_logger
+from src.cache import MemoryCacheBackend, ReadThroughCache, TTLCache
+from src.dependencies import DBSession, ReadDBSession
+from src.handlers.admission import client_ip, login_admission
+from src.handlers.token import ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE, TOKEN_TYPE_FIELD, create_access_token, create_refresh_token, decode_jwt, decode_jwt_cached, store_token
+from src.handlers.password import password_service
+from src.handlers.revocation import revocation_index
+from src.invalidation import ALL_KEYS, SALARY_EVENT, invalidation_bus
+from src.queries import LOGIN_GET, PASSWORD_REHASH, SALARY_GET, USER_CREATE
 from src.schemas import Token, TokenCreate, User, UserAuth, UserCreate, UserSalary
 
 
-settings: Settings = Settings()
-session: Callable = settings.database.get_session_async
-DBSession = Annotated[AsyncSession, Depends(session)]
+settings: Settings = get_settings()
 logger: logging = init_logger("app")
 http_bearer = HTTPBearer()
+salary_cache: ReadThroughCache = ReadThroughCache(
+    MemoryCacheBackend(max_size=settings.salary_cache_size, ttl=settings.salary_cache_ttl)
+)
+# keys written on this instance recently, their reads stay on the primary until replicas catch up
+recent_writes: TTLCache = TTLCache(max_size=settings.salary_cache_size, ttl=settings.db_read_your_writes_seconds)
+
+
+async def evict_salary(key: str) -> None:
+    if key == ALL_KEYS:
+        await salary_cache.invalidate_all()
+    else:
+        await salary_cache.invalidate(key)
+
+invalidation_bus.subscribe(SALARY_EVENT, evict_salary)
+invalidation_bus.on_resync(salary_cache.invalidate_all)
+
+def read_session_for(
+    key: str,
+    session: AsyncSession,
+    read_session: AsyncSession
+) -> AsyncSession:
+    return session if recent_writes.get(key) else read_session
 
 
 async def _user_create(
     body: UserCreate,
     session: DBSession
 ) -> User:
-    body: dict = body.model_dump(exclude_none=True)
-    employee_input: dict = {
-        'full_name': body.pop('full_name'),
-        'salary': body.pop('salary'),
-        'next_raise_date': body.pop('next_raise_date')
-    }
+    params: dict = body.model_dump()
+    params.update(
+        employee_id=uuid4(),
+        user_id=uuid4(),
+        password=(await password_service.hash_password(body.password)).decode()
+    )
     try:
         async with session.begin():
-            query: ReturningInsert = insert(Employees).values(**employee_input).returning(Employees.id)
-            result: Result = await session.execute(query)
-            employee: dict = dict(result.mappings().fetchone())
-
-            body['password'] = hash_password(body.get('password')).decode()
-            body.update( {'employee_id': employee.get('id') } )
-
-            query: Insert = insert(Users).values(**body)
-            result = await session.execute(query)
-            
-            query: Select = select(
-                Cast(Employees.id, String).label('employee_id'), Cast(Users.id, String).label('user_id'), 
-                Users.login, Employees.full_name, Employees.salary, Employees.next_raise_date
-            ).\
-                join(Users, Users.employee_id == Employees.id).\
-                where(Employees.id == employee.get('id'))
-            result = await session.execute(query)
+            result: Result = await session.execute(USER_CREATE, params)
             response = result.mappings().fetchone()
 
-            logger.info(f'Add user: {str(dict(response))}')
-            
-            return response
+            logger.info('Add user: %s', response, extra=HOT_PATH)
+        recent_writes.set(response.get('user_id'), True)
+        recent_writes.set(response.get('login'), True)
+        return response
     except exc.SQLAlchemyError as err:
         logger.error(f'Add user: {err.args[0]}')
         return Response(
@@ -68,26 +77,42 @@ async def _user_create(
 
 async def _user_token_get(
     user_auth: UserAuth,
-    session: DBSession
+    request: Request,
+    session: DBSession,
+    read_session: ReadDBSession
 ) -> Token:
-    query: Select = select(Cast(Users.id, String).label('user_id'), Users.login, Users.password).where(Users.login == user_auth.login)
-    result: Result = await session.execute(query)
-    if (response:= result.mappings().fetchone()):
+    login_admission.check(user_auth.login, client_ip(request))
+    lookup_session: AsyncSession = read_session_for(user_auth.login, session, read_session)
+    result: Result = await lookup_session.execute(LOGIN_GET, { 'login': user_auth.login })
+    response = result.mappings().fetchone()
+    await lookup_session.close()
+    if response:
         password: str = user_auth.password
         user: dict = dict(response)
         hashed_password: str = user.pop('password')
-        if (verify_password(password, hashed_password.encode())):
-            logger.info(f'Get user: {str(user)}')
+        new_password: bytes | None = None
+        async with login_admission.slot():
+            verified: bool = await password_service.verify_password(password, hashed_password.encode())
+            # the rehash costs as much as the verification, it runs under the same admission slot
+            if verified and password_service.needs_rehash(hashed_password.encode()):
+                new_password = await _hash_for_rehash(password)
+        if verified:
+            logger.info('Get user: %s', user, extra=HOT_PATH)
+            # both tokens of a login share a session id, revoking the session revokes the refresh token too
+            user['sid'] = uuid4().hex
             access_token: str = create_access_token(user)
             refresh_token: str = create_refresh_token(user)
-            payload: dict = decode_jwt(token=access_token)
-            token: TokenCreate = TokenCreate(
-                user_id=payload.get('user_id'),
-                token=access_token,
-                expires_at=datetime.fromtimestamp(payload.get('exp'))
-            )
-            await session.close()
-            await save_token_in_db(token, session)
+            for issued in (access_token, refresh_token):
+                payload: dict = decode_jwt(token=issued)
+                token: TokenCreate = TokenCreate(
+                    user_id=payload.get('user_id'),
+                    token=issued,
+                    expires_at=datetime.fromtimestamp(payload.get('exp')),
+                    session_id=user['sid']
+                )
+                await store_token(token, session)
+            if new_password is not None:
+                await _rehash_password(user.get('user_id'), new_password.decode(), hashed_password, session)
             return Token(
                 access_token=access_token,
                 refresh_token=refresh_token
@@ -98,6 +123,30 @@ async def _user_token_get(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+async def _hash_for_rehash(password: str) -> bytes | None:
+    # best effort, the login already succeeded and the next one will try again
+    try:
+        return await password_service.hash_password(password)
+    except HTTPException as err:
+        logger.error(f'Rehash password: {err.detail}')
+        return None
+
+async def _rehash_password(
+    user_id: str,
+    new_password: str,
+    old_password: str,
+    session: AsyncSession
+) -> None:
+    try:
+        async with session.begin():
+            await session.execute(PASSWORD_REHASH, {
+                'user_id': user_id, 'old_password': old_password, 'new_password': new_password
+            })
+        password_service.rehashed += 1
+        logger.info('Rehash password of user %r', user_id, extra=HOT_PATH)
+    except exc.SQLAlchemyError as err:
+        logger.error(f'Rehash password: {err.args[0]}')
+
 
 def validate_current_token(token_type: str, current_token_type: str):
     if (current_token_type != token_type):
@@ -106,12 +155,12 @@ def validate_current_token(token_type: str, current_token_type: str):
             detail=f"Invalid token type {current_token_type!r} expected {token_type!r}"
         )
 
-def get_current_user(
+async def get_current_user(
     token_type: str,
     credentials: HTTPAuthorizationCredentials = Depends(http_bearer)
 ) -> dict:
     try:
-        payload: dict = decode_jwt(token=credentials.credentials)
+        payload: dict = decode_jwt_cached(token=credentials.credentials)
         current_token_type: str = payload.get(TOKEN_TYPE_FIELD)
         validate_current_token(token_type, current_token_type)
     except InvalidTokenError as e:
@@ -119,10 +168,22 @@ def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid token error"
         )
+    if await revocation_index.is_revoked(credentials.credentials):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
     return payload
 
-protected_access = partial(get_current_user, token_type=ACCESS_TOKEN_TYPE)
-protected_refresh = partial(get_current_user, token_type=REFRESH_TOKEN_TYPE)
+async def protected_access(
+    credentials: HTTPAuthorizationCredentials = Depends(http_bearer)
+) -> dict:
+    return await get_current_user(ACCESS_TOKEN_TYPE, credentials)
+
+async def protected_refresh(
+    credentials: HTTPAuthorizationCredentials = Depends(http_bearer)
+) -> dict:
+    return await get_current_user(REFRESH_TOKEN_TYPE, credentials)
 
 def login_required(
     user: dict = Depends(protected_access)
@@ -135,20 +196,25 @@ def login_required(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+async def _load_user_salary(
+    user_id: UUID,
+    session: DBSession
+) -> dict | None:
+    result: Result = await session.execute(SALARY_GET, { 'user_id': user_id })
+    if (response:= result.mappings().fetchone()):
+        return dict(response)
+    return None
+
 async def _user_salary_get(
     user_id: UUID,
     session: DBSession
 ) -> UserSalary:
-    query: Select = select(
-        Cast(Employees.id, String).label('employee_id'), Cast(Users.id, String).label('user_id'), 
-        Employees.salary, Employees.next_raise_date
-    ).\
-        join(Users, Users.employee_id == Employees.id).\
-        where(Users.id == user_id)
-    result: Result = await session.execute(query)
-    if (response:= result.mappings().fetchone()):
-        logger.info(f'Get user\'s salary: {str(dict(response))}')
+    response: dict | None = await salary_cache.get_or_load(
+        str(user_id), partial(_load_user_salary, user_id, session)
+    )
+    if response:
+        logger.info('Get user\'s salary: %s', response, extra=HOT_PATH)
         return response
     else:
-        logger.info(f'User\'s (id = {str(user_id)}) salary not found')
+        logger.info('User\'s (id = %s) salary not found', user_id, extra=HOT_PATH)
         return Response(status_code=status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,221 @@
+from collections import deque
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Iterator
+from uuid import uuid4
+import csv
+import json
+import logging
+
+import asyncpg
+from fastapi import HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import Result, TextClause, exc, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import Settings, get_settings
+from loggers import init_logger
+from src.dependencies import DBSession
+from src.handlers.password import password_service
+from src.schemas import UserCreate
+
+
+NDJSON_MEDIA_TYPE: str = "application/x-ndjson"
+CSV_MEDIA_TYPE: str = "text/csv"
+IMPORT_COLUMNS: tuple[str, ...] = (
+    'line', 'employee_id', 'user_id', 'login', 'password', 'full_name', 'salary', 'next_raise_date'
+)
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+
+CREATE_IMPORT_TABLE: TextClause = text("""
+    CREATE TEMP TABLE user_import (
+        line integer NOT NULL,
+        employee_id uuid NOT NULL,
+        user_id uuid NOT NULL,
+        login varchar(20) NOT NULL,
+        password varchar(100) NOT NULL,
+        full_name varchar NOT NULL,
+        salary integer NOT NULL,
+        next_raise_date timestamp NOT NULL
+    ) ON COMMIT DROP
+""")
+EXISTING_LOGINS: TextClause = text("SELECT login FROM users WHERE login = ANY(:logins)").\
+    execution_options(metric_name='user_bulk_create')
+MOVE_IMPORTED_USERS: TextClause = text("""
+    WITH fresh AS (
+        SELECT DISTINCT ON (i.login) i.*
+        FROM user_import i
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.login = i.login)
+        ORDER BY i.login, i.line
+    ), new_employees AS (
+        INSERT INTO employees (id, full_name, salary, next_raise_date)
+        SELECT employee_id, full_name, salary, next_raise_date FROM fresh
+    )
+    INSERT INTO users (id, login, password, employee_id)
+    SELECT user_id, login, password, employee_id FROM fresh
+    RETURNING login
+""").execution_options(metric_name='user_bulk_create')
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer: bytes = b''
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode().rstrip('\r')
+    if buffer:
+        yield buffer.decode().rstrip('\r')
+
+class CSVFeed:
+    # csv.reader pulls lines one at a time and the request stream pushes them in as they arrive;
+    # records are read once no quoted field is left open, so a field may span several lines
+    def __init__(self) -> None:
+        self._lines: deque[str] = deque()
+        self._reader: Iterator[list[str]] = csv.reader(self)
+        self._in_quotes: bool = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if not self._lines:
+            raise StopIteration
+        return self._lines.popleft()
+
+    def push(self, line: str) -> None:
+        self._lines.append(line+'\n')
+        self._in_quotes ^= line.count('"') % 2 == 1
+
+    def records(self, final: bool = False) -> Iterator[tuple[int, list[str]]]:
+        # an unterminated quote at the end of the body takes the rest, the reader returns what it has
+        if self._in_quotes and not final:
+            return
+        while self._lines:
+            line_number: int = self._reader.line_num+1
+            yield line_number, next(self._reader)
+
+async def iter_csv_rows(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, list[str]]]:
+    feed: CSVFeed = CSVFeed()
+    async for line in iter_lines(stream):
+        feed.push(line)
+        for row in feed.records():
+            yield row
+    for row in feed.records(final=True):
+        yield row
+
+async def iter_records(request: Request) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    media_type: str = request.headers.get('content-type', NDJSON_MEDIA_TYPE).split(';')[0].strip()
+    if media_type not in (NDJSON_MEDIA_TYPE, CSV_MEDIA_TYPE):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content type {media_type!r} expected {NDJSON_MEDIA_TYPE!r} or {CSV_MEDIA_TYPE!r}"
+        )
+    if media_type == CSV_MEDIA_TYPE:
+        header: list[str] | None = None
+        async for line_number, values in iter_csv_rows(request.stream()):
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = values
+                continue
+            yield line_number, dict(zip(header, values)), None
+        return
+    line_number: int = 0
+    async for line in iter_lines(request.stream()):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except json.JSONDecodeError as err:
+            yield line_number, None, str(err)
+
+def write_result(results: SpooledTemporaryFile, **result) -> None:
+    results.write(json.dumps(result, default=str).encode()+b'\n')
+
+async def _import_chunk(
+    rows: list[tuple[int, UserCreate]],
+    session: AsyncSession,
+    results: SpooledTemporaryFile
+) -> None:
+    logins: list[str] = [row.login for _, row in rows]
+    result: Result = await session.execute(EXISTING_LOGINS, { 'logins': logins })
+    seen: set[str] = set(result.scalars().all())
+    await session.close()
+
+    fresh: list[tuple[int, UserCreate]] = []
+    for line, row in rows:
+        if row.login in seen:
+            write_result(results, line=line, login=row.login, status="conflict", error="Login already exists")
+        else:
+            seen.add(row.login)
+            fresh.append((line, row))
+    if not fresh:
+        return
+
+    try:
+        passwords: list[bytes] = await password_service.hash_passwords([row.password for _, row in fresh])
+        records: list[tuple] = [
+            (line, uuid4(), uuid4(), row.login, password.decode(), row.full_name, row.salary, row.next_raise_date)
+            for (line, row), password in zip(fresh, passwords)
+        ]
+        async with session.begin():
+            await session.execute(CREATE_IMPORT_TABLE)
+            connection = await (await session.connection()).get_raw_connection()
+            await connection.driver_connection.copy_records_to_table(
+                'user_import', records=records, columns=IMPORT_COLUMNS
+            )
+            result = await session.execute(MOVE_IMPORTED_USERS)
+            created: set[str] = set(result.scalars().all())
+    # COPY runs on the raw asyncpg connection, a value the columns reject surfaces as a driver error:
+    # a too long login from the server, an out of range salary already while encoding
+    except (exc.SQLAlchemyError, HTTPException, asyncpg.PostgresError, asyncpg.InterfaceError) as err:
+        error: str = err.detail if isinstance(err, HTTPException) else str(err.args[0] if err.args else err)
+        logger.error(f'Bulk add users: {error}')
+        for line, row in fresh:
+            write_result(results, line=line, login=row.login, status="error", error=error)
+        return
+
+    for line, _, user_id, login, *_ in records:
+        if login in created:
+            write_result(results, line=line, login=login, status="created", user_id=str(user_id))
+        else:
+            write_result(results, line=line, login=login, status="conflict", error="Login already exists")
+    logger.info(f'Bulk add users: {len(created)} of {len(records)} created')
+
+def iter_results(results: SpooledTemporaryFile) -> Iterator[bytes]:
+    try:
+        results.seek(0)
+        yield from results
+    finally:
+        results.close()
+
+async def _user_bulk_create(
+    request: Request,
+    session: DBSession
+) -> StreamingResponse:
+    results: SpooledTemporaryFile = SpooledTemporaryFile(max_size=settings.bulk_import_spool_size)
+    chunk: list[tuple[int, UserCreate]] = []
+    async for line, record, error in iter_records(request):
+        if error is None:
+            try:
+                row: UserCreate = UserCreate.model_validate(record)
+                if row.next_raise_date is None:
+                    error = "Field next_raise_date is required"
+            except ValidationError as err:
+                error = '; '.join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in err.errors())
+        if error is not None:
+            login: str | None = record.get('login') if isinstance(record, dict) else None
+            write_result(results, line=line, login=login, status="invalid", error=error)
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= settings.bulk_import_chunk_size:
+            await _import_chunk(chunk, session, results)
+            chunk = []
+    if chunk:
+        await _import_chunk(chunk, session, results)
+    return StreamingResponse(iter_results(results), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,211 @@
+from inspect import isawaitable
+from typing import Awaitable, Callable
+from uuid import uuid4
+import asyncio
+import logging
+
+import asyncpg
+from sqlalchemy import exc
+from sqlalchemy.engine import URL
+
+from config.database import DataBaseServer
+from config.settings import Settings, get_settings
+from loggers import init_logger
+
+
+SALARY_EVENT: str = "salary"
+REVOKE_EVENT: str = "revoke"
+DIAGNOSTICS_EVENT: str = "diagnostics"
+ALL_KEYS: str = "*"
+
+settings: Settings = get_settings()
+logger: logging = init_logger("app")
+
+Handler = Callable[[str], Awaitable[None] | None]
+ResyncHandler = Callable[[], Awaitable[None] | None]
+
+
+class InvalidationBus:
+    def __init__(
+        self,
+        database: DataBaseServer,
+        enabled: bool,
+        channel: str,
+        queue_size: int,
+        batch_size: int,
+        ping_interval: float,
+        reconnect_delay: float,
+        max_reconnect_delay: float
+    ) -> None:
+        self.database = database
+        self.enabled = enabled
+        self.channel = channel
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        # events carry their origin so a worker skips its own, it has already applied them
+        self.origin = uuid4().hex[:12]
+        # every event of an origin is numbered, a listener that sees a number skipped resyncs
+        self.sequence = 0
+        self.connected = False
+        self.published = 0
+        self.dropped = 0
+        self.received = 0
+        self.reconnects = 0
+        self.resyncs = 0
+        self.gaps = 0
+        self._last_seen: dict[str, int] = {}
+        self._unsent: list[str] = []
+        self._handlers: dict[str, Handler] = {}
+        self._resync_handlers: list[ResyncHandler] = []
+        self._outbox: asyncio.Queue | None = None
+        self._pending: set[asyncio.Future] = set()
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    def on_resync(self, handler: ResyncHandler) -> None:
+        self._resync_handlers.append(handler)
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._outbox = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.connected = False
+
+    # called after the writer's commit, the send happens in the background on the listener connection
+    def publish(self, kind: str, key: str) -> None:
+        if self._outbox is None:
+            return
+        # a dropped event still takes its number, so the listeners notice the gap
+        self.sequence += 1
+        try:
+            self._outbox.put_nowait(f'{self.origin}|{self.sequence}|{kind}|{key}')
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _connect(self) -> asyncpg.Connection:
+        url: URL = self.database.engine.url
+        return await asyncpg.connect(
+            host=url.host, port=url.port, user=url.username, password=url.password, database=url.database
+        )
+
+    async def _run(self) -> None:
+        delay: float = self.reconnect_delay
+        first: bool = True
+        while True:
+            connection: asyncpg.Connection | None = None
+            try:
+                connection = await self._connect()
+                lost: asyncio.Event = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                delay = self.reconnect_delay
+                if not first:
+                    # events sent while nobody listened are gone, drop everything that may be stale
+                    await self._resync()
+                await self._send(connection, lost)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError, exc.SQLAlchemyError) as err:
+                logger.error(f'Invalidation listener: {err}')
+            finally:
+                self.connected = False
+                first = False
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay*2, self.max_reconnect_delay)
+
+    async def _flush(self, connection: asyncpg.Connection) -> None:
+        # the batch is kept until the send succeeds, a dropped connection sends it again after reconnecting
+        await connection.execute(
+            "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload", self.channel, self._unsent
+        )
+        self.published += len(self._unsent)
+        self._unsent = []
+
+    async def _send(self, connection: asyncpg.Connection, lost: asyncio.Event) -> None:
+        if self._unsent:
+            await self._flush(connection)
+        while not lost.is_set():
+            try:
+                payload: str = await asyncio.wait_for(self._outbox.get(), self.ping_interval)
+            except asyncio.TimeoutError:
+                # an idle half-open connection only shows up when something is sent over it
+                await asyncio.wait_for(connection.execute("SELECT 1"), self.ping_interval)
+                continue
+            self._unsent.append(payload)
+            while len(self._unsent) < self.batch_size and not self._outbox.empty():
+                self._unsent.append(self._outbox.get_nowait())
+            await self._flush(connection)
+        raise asyncpg.InterfaceError("listener connection was closed")
+
+    def _on_notify(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        origin, sequence, kind, key = payload.split("|", 3)
+        if origin == self.origin:
+            return
+        number: int = int(sequence)
+        last: int | None = self._last_seen.get(origin)
+        if last is not None and number <= last:
+            # a batch resent after a dropped connection, its events were applied already
+            return
+        self._last_seen[origin] = number
+        self.received += 1
+        if last is not None and number > last+1:
+            # the publisher lost events, whatever they would have evicted may be stale now
+            self.gaps += 1
+            logger.warning(f'Invalidation events {last+1}..{number-1} from {origin!r} are lost, resyncing')
+            self._track(self._resync())
+        handler: Handler | None = self._handlers.get(kind)
+        if handler is not None and isawaitable(result := handler(key)):
+            self._track(result)
+
+    def _track(self, awaitable: Awaitable) -> None:
+        future: asyncio.Future = asyncio.ensure_future(awaitable)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    async def _resync(self) -> None:
+        self.resyncs += 1
+        for handler in self._resync_handlers:
+            if isawaitable(result := handler()):
+                await result
+        logger.info('Invalidation listener local caches resynced')
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'connected': self.connected,
+            'published': self.published,
+            'dropped': self.dropped,
+            'received': self.received,
+            'reconnects': self.reconnects,
+            'resyncs': self.resyncs,
+            'gaps': self.gaps,
+            'unsent': len(self._unsent)
+        }
+
+
+invalidation_bus: InvalidationBus = InvalidationBus(
+    database=settings.database,
+    enabled=settings.invalidation_enabled,
+    channel=settings.invalidation_channel,
+    queue_size=settings.invalidation_queue_size,
+    batch_size=settings.invalidation_batch_size,
+    ping_interval=settings.invalidation_ping_interval,
+    reconnect_delay=settings.invalidation_reconnect_delay,
+    max_reconnect_delay=settings.invalidation_max_reconnect_delay
+)
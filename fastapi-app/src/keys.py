@@ -0,0 +1,120 @@
+from base64 import urlsafe_b64encode
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+import json
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, ed448, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes, PublicKeyTypes
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+from jwt.exceptions import InvalidTokenError
+
+
+RSA_ALGORITHMS: tuple[str, ...] = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512")
+EC_ALGORITHMS: dict[str, str] = { "secp256r1": "ES256", "secp384r1": "ES384", "secp521r1": "ES512" }
+EDDSA_ALGORITHM: str = "EdDSA"
+# RFC 7638 members that take part in the thumbprint for each key type
+THUMBPRINT_MEMBERS: dict[str, tuple[str, ...]] = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x")
+}
+
+
+def default_algorithm(public_key: PublicKeyTypes) -> str:
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return RSA_ALGORITHMS[0]
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return EC_ALGORITHMS[public_key.curve.name]
+    if isinstance(public_key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+        return EDDSA_ALGORITHM
+    raise ValueError(f"Unsupported key type {type(public_key).__name__!r}")
+
+def validate_algorithm(public_key: PublicKeyTypes, algorithm: str) -> None:
+    if isinstance(public_key, rsa.RSAPublicKey):
+        allowed: tuple[str, ...] = RSA_ALGORITHMS
+    else:
+        allowed = (default_algorithm(public_key),)
+    if algorithm not in allowed:
+        raise ValueError(f"Algorithm {algorithm!r} does not match the key, expected one of {allowed!r}")
+
+def public_jwk(public_key: PublicKeyTypes) -> dict:
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return ECAlgorithm.to_jwk(public_key, as_dict=True)
+    return OKPAlgorithm.to_jwk(public_key, as_dict=True)
+
+def thumbprint(jwk: dict) -> str:
+    members: dict = { name: jwk[name] for name in THUMBPRINT_MEMBERS[jwk["kty"]] }
+    digest: bytes = sha256(json.dumps(members, separators=(",", ":"), sort_keys=True).encode()).digest()
+    return urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+@dataclass
+class JWTKey:
+    kid: str
+    algorithm: str
+    public_key: PublicKeyTypes
+    private_key: PrivateKeyTypes | None = None
+
+    @classmethod
+    def load(
+        cls,
+        public_key_file: Path,
+        private_key_file: Path | None = None,
+        algorithm: str | None = None,
+        kid: str | None = None
+    ) -> "JWTKey":
+        public_key: PublicKeyTypes = load_pem_public_key(public_key_file.read_bytes())
+        private_key: PrivateKeyTypes | None = None
+        if private_key_file is not None:
+            private_key = load_pem_private_key(private_key_file.read_bytes(), password=None)
+        algorithm = algorithm or default_algorithm(public_key)
+        validate_algorithm(public_key, algorithm)
+        return cls(
+            kid=kid or thumbprint(public_jwk(public_key)),
+            algorithm=algorithm,
+            public_key=public_key,
+            private_key=private_key
+        )
+
+    def jwk(self) -> dict:
+        return { **public_jwk(self.public_key), "kid": self.kid, "alg": self.algorithm, "use": "sig" }
+
+
+class KeyManager:
+    def __init__(self, signing_key: JWTKey, verification_keys: list[JWTKey]) -> None:
+        if signing_key.private_key is None:
+            raise ValueError(f"Signing key {signing_key.kid!r} has no private key")
+        self.signing_key = signing_key
+        self.keys: dict[str, JWTKey] = { key.kid: key for key in verification_keys }
+        self.keys[signing_key.kid] = signing_key
+
+    @classmethod
+    def from_files(
+        cls,
+        algorithm: str,
+        private_key_file: Path,
+        public_key_file: Path,
+        previous_public_key_files: list[Path],
+        key_id: str | None = None
+    ) -> "KeyManager":
+        return cls(
+            signing_key=JWTKey.load(public_key_file, private_key_file, algorithm, key_id),
+            verification_keys=[JWTKey.load(path) for path in previous_public_key_files]
+        )
+
+    def verification_key(self, token: str | bytes) -> JWTKey:
+        kid: str | None = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            # tokens issued before key ids were introduced
+            return self.signing_key
+        if (key:= self.keys.get(kid)) is None:
+            raise InvalidTokenError(f"Unknown key id {kid!r}")
+        return key
+
+    def jwks(self) -> dict:
+        return { "keys": [key.jwk() for key in self.keys.values()] }
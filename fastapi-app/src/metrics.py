@@ -0,0 +1,194 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, ExceptionContext, ExecutionContext
+from sqlalchemy.ext.asyncio.engine import AsyncEngine
+
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_NAME_OPTION: str = "metric_name"
+UNNAMED_STATEMENT: str = "other"
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs: list[str] = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{"+",".join(pairs)+"}" if pairs else ""
+
+
+class Metric:
+    type_name: str = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0)+amount
+
+    def render(self) -> list[str]:
+        return self.header()+[
+            f'{self.name}{format_labels(self.label_names, labels)} {value}' for labels, value in self._values.items()
+        ]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = buckets
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series: list | None = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0]*(len(self.buckets)+1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started: float = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter()-started, *labels)
+
+    def render(self) -> list[str]:
+        lines: list[str] = self.header()
+        for labels, (counts, total) in self._series.items():
+            cumulative: int = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le: str = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[Metric] = []
+        self._collectors: dict[str, Callable[[], dict]] = {}
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Counter:
+        metric: Counter = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Histogram:
+        metric: Histogram = Histogram(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, stats: Callable[[], dict]) -> None:
+        self._collectors[prefix] = stats
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats in self._collectors.items():
+            try:
+                values: dict = stats()
+            except RuntimeError:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE {prefix}_{key} gauge')
+                    lines.append(f'{prefix}_{key} {value}')
+        return "\n".join(lines)+"\n"
+
+
+registry: Registry = Registry()
+http_request_seconds: Histogram = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+db_statement_seconds: Histogram = registry.histogram(
+    "db_statement_duration_seconds", "Database statement latency by logical name", ("statement",)
+)
+password_seconds: Histogram = registry.histogram(
+    "password_duration_seconds", "bcrypt hashing and verification latency", ("operation",)
+)
+jwt_seconds: Histogram = registry.histogram(
+    "jwt_duration_seconds", "JWT signing and verification latency", ("operation",)
+)
+login_throttled: Counter = registry.counter(
+    "login_throttled_total", "Login requests rejected by admission control", ("reason",)
+)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started: float = perf_counter()
+        status_code: list[int] = [500]
+
+        async def send_wrapper(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_seconds.observe(
+                perf_counter()-started,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status_code[0])
+            )
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn: Connection, cursor, statement: str, parameters, context: ExecutionContext, executemany: bool
+    ) -> None:
+        conn.info.setdefault("statement_started", []).append(perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(
+        conn: Connection, cursor, statement: str, parameters, context: ExecutionContext, executemany: bool
+    ) -> None:
+        started: float = conn.info["statement_started"].pop()
+        name: str = context.execution_options.get(STATEMENT_NAME_OPTION, UNNAMED_STATEMENT)
+        db_statement_seconds.observe(perf_counter()-started, name)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context: ExceptionContext) -> None:
+        if context.connection is not None and context.connection.info.get("statement_started"):
+            context.connection.info["statement_started"].pop()
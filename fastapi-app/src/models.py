@@ -1,7 +1,7 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import ForeignKey, String, UUID
+from sqlalchemy import ForeignKey, Index, LargeBinary, String, UUID, text
 from sqlalchemy.orm import Mapped, mapped_column, DeclarativeBase, relationship
 
 class ShiftBase(DeclarativeBase):
@@ -23,16 +23,43 @@ class Employees(ShiftBase):
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     full_name: Mapped[str]
     salary: Mapped[int]
-    next_raise_date: Mapped[datetime]
+    next_raise_date: Mapped[datetime] = mapped_column(index=True)
     
     user: Mapped["Users"] = relationship(back_populates="employee", uselist=False)
 
 class Tokens(ShiftBase):
     __tablename__ = "tokens"
+    __table_args__ = (
+        Index("ix_tokens_token_hash", "token_hash", "expires_at", unique=True),
+        { "postgresql_partition_by": "RANGE (expires_at)" }
+    )
     id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
     user_id: Mapped[UUID] = mapped_column(ForeignKey("users.id"))
-    token: Mapped[str] = mapped_column(String(4000), index=True)
-    expires_at: Mapped[datetime]
+    token: Mapped[str] = mapped_column(String(4000))
+    token_hash: Mapped[bytes] = mapped_column(LargeBinary(32))
+    expires_at: Mapped[datetime] = mapped_column(primary_key=True)
     is_active: Mapped[bool] = mapped_column(nullable=True, default=True)
+    session_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=True)
     
     user: Mapped["Users"] = relationship("Users", back_populates="token")
+
+
+class SalaryRaiseRuns(ShiftBase):
+    __tablename__ = "salary_raise_runs"
+    id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    cutoff: Mapped[datetime]
+    started_at: Mapped[datetime]
+    finished_at: Mapped[datetime] = mapped_column(nullable=True)
+    last_employee_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), nullable=True)
+    processed: Mapped[int] = mapped_column(default=0)
+
+
+class SalaryRaises(ShiftBase):
+    __tablename__ = "salary_raises"
+    id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid4, server_default=text("gen_random_uuid()"))
+    run_id: Mapped[UUID] = mapped_column(ForeignKey("salary_raise_runs.id"), index=True)
+    employee_id: Mapped[UUID] = mapped_column(ForeignKey("employees.id"), index=True)
+    old_salary: Mapped[int]
+    new_salary: Mapped[int]
+    old_raise_date: Mapped[datetime]
+    new_raise_date: Mapped[datetime]
@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+
+
+class StartupProfiler:
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.phases: dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started: float = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter()-started)
+
+    def report(self) -> dict:
+        return { **self.phases, 'total': sum(self.phases.values()) }
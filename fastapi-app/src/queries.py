@@ -0,0 +1,65 @@
+from sqlalchemy import CTE, UUID, Cast, DateTime, Integer, Select, String, Update, bindparam, insert, select, update
+
+from src.models import Employees, Users
+
+
+# module-level statements hit SQLAlchemy's compiled cache and asyncpg's
+# per-connection prepared statement cache on every call after the first
+
+_employee: CTE = insert(Employees).\
+    values(
+        id=bindparam('employee_id', type_=UUID(as_uuid=True)),
+        full_name=bindparam('full_name', type_=String),
+        salary=bindparam('salary', type_=Integer),
+        next_raise_date=bindparam('next_raise_date', type_=DateTime)
+    ).\
+    returning(Employees.id, Employees.full_name, Employees.salary, Employees.next_raise_date).\
+    cte('employee')
+
+_user: CTE = insert(Users).\
+    from_select(
+        ['id', 'login', 'password', 'employee_id'],
+        select(
+            bindparam('user_id', type_=UUID(as_uuid=True)),
+            bindparam('login', type_=String),
+            bindparam('password', type_=String),
+            _employee.c.id
+        )
+    ).\
+    returning(Users.id, Users.login, Users.employee_id).\
+    cte('new_user')
+
+USER_CREATE: Select = select(
+    Cast(_employee.c.id, String).label('employee_id'), Cast(_user.c.id, String).label('user_id'),
+    _user.c.login, _employee.c.full_name, _employee.c.salary, _employee.c.next_raise_date
+).\
+    join_from(_user, _employee, _user.c.employee_id == _employee.c.id).\
+    execution_options(metric_name='user_create')
+
+LOGIN_GET: Select = select(Cast(Users.id, String).label('user_id'), Users.login, Users.password).\
+    where(Users.login == bindparam('login')).\
+    execution_options(metric_name='login_get')
+
+# the old hash in the condition keeps a concurrent password change from being overwritten
+PASSWORD_REHASH: Update = update(Users).\
+    where(Users.id == bindparam('user_id', type_=UUID(as_uuid=True)), Users.password == bindparam('old_password')).\
+    values(password=bindparam('new_password')).\
+    execution_options(metric_name='password_rehash')
+
+SALARY_GET: Select = select(
+    Cast(Employees.id, String).label('employee_id'), Cast(Users.id, String).label('user_id'), 
+    Employees.salary, Employees.next_raise_date
+).\
+    join(Users, Users.employee_id == Employees.id).\
+    where(Users.id == bindparam('user_id', type_=UUID(as_uuid=True))).\
+    execution_options(metric_name='salary_get')
+
+# keyset pages over employees.id, callers add the page bound and filters
+SALARY_EXPORT: Select = select(
+    Cast(Employees.id, String).label('employee_id'), Cast(Users.id, String).label('user_id'),
+    Users.login, Employees.full_name, Employees.salary, Employees.next_raise_date,
+    Employees.id.label('cursor')
+).\
+    join(Users, Users.employee_id == Employees.id).\
+    order_by(Employees.id).\
+    execution_options(metric_name='salary_export')
@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable
+import math
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: int, max_keys: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.throttled = 0
+        self.evicted = 0
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    # takes one token for key, returns 0 on success or the seconds until the next token
+    def acquire(self, key: Hashable) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now: float = monotonic()
+        tokens, updated_at = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens+(now-updated_at)*self.rate)
+        if tokens >= 1.0:
+            tokens -= 1.0
+            retry_after: float = 0.0
+            self.allowed += 1
+        else:
+            retry_after = (1.0-tokens)/self.rate
+            self.throttled += 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # least recently seen keys are dropped first, a dropped key starts again with a full bucket
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'keys': len(self._buckets),
+            'max_keys': self.max_keys,
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+            'evicted': self.evicted
+        }
+
+
+def retry_after_header(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
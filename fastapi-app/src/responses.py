@@ -0,0 +1,78 @@
+from datetime import date, datetime
+from typing import Any
+from uuid import UUID
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from config.settings import Settings, get_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MEDIA_TYPES: tuple[str, ...] = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+settings: Settings = get_settings()
+
+
+def dumps_json(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return to_json(content)
+
+def msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+class MsgPackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=msgpack_default)
+
+
+def accepts_msgpack(request: Request) -> bool:
+    accept: str = request.headers.get("accept", "")
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+def respond(
+    request: Request,
+    content: Any,
+    model: type[BaseModel],
+    status_code: int = 200
+) -> Any:
+    # rows come from typed columns, so the fast path only trims them to the model's fields
+    # instead of validating and serialising them through response_model a second time
+    if isinstance(content, Response) or content is None:
+        return content
+    msgpack_requested: bool = accepts_msgpack(request)
+    if not (settings.fast_responses or msgpack_requested):
+        return content
+    if isinstance(content, BaseModel):
+        body: dict = content.model_dump(exclude_none=True)
+    else:
+        body: dict = { key: content[key] for key in model.model_fields if key in content }
+    headers: dict = { "Vary": "Accept" }
+    if msgpack_requested:
+        return MsgPackResponse(body, status_code=status_code, headers=headers)
+    return FastJSONResponse(body, status_code=status_code, headers=headers)
@@ -1,33 +1,53 @@
-from typing import Annotated, Callable
+from datetime import datetime
+from typing import Literal
+from uuid import UUID
 
-from fastapi import APIRouter, Depends, status
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Request, status
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from config.settings import Settings
-from src.handlers.token import create_access_token
-from src.handlers.user import _user_create, _user_token_get, _user_salary_get, login_required, protected_refresh
-from src.schemas import AccessToken, Token, User, UserCreate, UserSalary
+from src.dependencies import AppDatabase, DBSession, ReadDBSession
+from src.diagnostics import diagnostics
+from src.handlers.admission import login_admission
+from src.handlers.diagnostics import _diagnostics_update, diagnostics_required
+from src.handlers.revocation import _token_revoke, revocation_index
+from src.handlers.salary_export import _salary_export, salary_export_required
+from src.handlers.salary_raise import salary_raiser
+from src.handlers.token import create_access_token, get_key_manager, token_cache, token_writer
+from src.handlers.token_reaper import token_reaper
+from src.handlers.user import _user_create, _user_token_get, _user_salary_get, http_bearer, login_required, protected_refresh, read_session_for, salary_cache
+from src.handlers.user_import import _user_bulk_create
+from src.invalidation import invalidation_bus
+from src.keys import KeyManager
+from src.metrics import registry
+from src.responses import respond
+from src.schemas import AccessToken, DiagnosticsUpdate, Token, User, UserCreate, UserSalary
 
 
-settings: Settings = Settings()
-session: Callable = settings.database.get_session_async
-DBSession = Annotated[AsyncSession, Depends(session)]
-
 router: APIRouter = APIRouter()
 
 
 @router.post("/user/create", status_code=status.HTTP_201_CREATED, response_model=User)
 async def user_create(
     body: UserCreate, 
+    request: Request,
     session: DBSession
 ) -> User:
-    return await _user_create(body, session)
+    return respond(request, await _user_create(body, session), User, status.HTTP_201_CREATED)
+
+@router.post("/user/bulk_create")
+async def user_bulk_create(
+    request: Request,
+    session: DBSession
+) -> StreamingResponse:
+    return await _user_bulk_create(request, session)
 
 @router.post("/user/login")
 async def user_login(
+    request: Request,
     token: dict = Depends(_user_token_get)
 ) -> Token:
-    return token
+    return respond(request, token, Token)
 
 @router.get(
     "/user/salary/get", 
@@ -35,10 +55,25 @@ async def user_login(
     response_model_exclude_unset=True
 )
 async def user_salary_get(
+    request: Request,
     session: DBSession,
+    read_session: ReadDBSession,
     user: dict = Depends(login_required)
 ) -> UserSalary | None:
-    return await _user_salary_get(user.get('user_id'), session)
+    response: UserSalary | None = await _user_salary_get(
+        user.get('user_id'), read_session_for(user.get('user_id'), session, read_session)
+    )
+    return respond(request, response, UserSalary)
+
+@router.get("/user/salary/export")
+async def user_salary_export(
+    format: Literal['ndjson', 'csv'] = 'ndjson',
+    after: UUID | None = None,
+    raise_from: datetime | None = None,
+    raise_to: datetime | None = None,
+    user: dict = Depends(salary_export_required)
+) -> StreamingResponse:
+    return await _salary_export(user, format, after, raise_from, raise_to)
 
 @router.post(
     "/token/refresh/",
@@ -47,9 +82,78 @@ async def user_salary_get(
     response_model_exclude_unset=True
 )
 def token_refresh(
+    request: Request,
     user: dict = Depends(protected_refresh)
 ) -> AccessToken:
     access_token: str = create_access_token(user)
-    return AccessToken(
-        access_token=access_token
-    )
+    return respond(request, AccessToken(access_token=access_token), AccessToken)
+
+@router.post("/token/revoke/")
+async def token_revoke(
+    session: DBSession,
+    revoke_all: bool = False,
+    credentials: HTTPAuthorizationCredentials = Depends(http_bearer),
+    user: dict = Depends(login_required)
+) -> dict:
+    return await _token_revoke(credentials.credentials, user, revoke_all, session)
+
+@router.get("/.well-known/jwks.json")
+async def jwks(
+    key_manager: KeyManager = Depends(get_key_manager)
+) -> dict:
+    return key_manager.jwks()
+
+@router.get("/database/pool/status")
+async def database_pool_status(database: AppDatabase) -> dict:
+    return database.pool_status()
+
+@router.get("/database/replicas/status")
+async def database_replicas_status(database: AppDatabase) -> dict:
+    return database.replica_status()
+
+@router.get("/user/login/admission/status")
+async def login_admission_status() -> dict:
+    return login_admission.stats()
+
+@router.get("/token/cache/status")
+async def token_cache_status() -> dict:
+    return token_cache.stats()
+
+@router.get("/token/writer/status")
+async def token_writer_status() -> dict:
+    return token_writer.stats()
+
+@router.get("/user/salary/cache/status")
+async def salary_cache_status() -> dict:
+    return salary_cache.stats()
+
+@router.get("/user/salary/raises/status")
+async def salary_raiser_status() -> dict:
+    return salary_raiser.stats()
+
+@router.get("/token/revocation/status")
+async def token_revocation_status() -> dict:
+    return revocation_index.stats()
+
+@router.get("/token/reaper/status")
+async def token_reaper_status() -> dict:
+    return token_reaper.stats()
+
+@router.get("/cache/invalidation/status")
+async def cache_invalidation_status() -> dict:
+    return invalidation_bus.stats()
+
+@router.get("/diagnostics/status")
+async def diagnostics_status() -> dict:
+    return diagnostics.stats()
+
+@router.post("/diagnostics")
+async def diagnostics_update(
+    body: DiagnosticsUpdate,
+    user: dict = Depends(diagnostics_required)
+) -> dict:
+    return _diagnostics_update(body)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
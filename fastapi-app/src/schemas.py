@@ -1,5 +1,5 @@
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class TunedModel(BaseModel):
     class Config:
@@ -9,6 +9,7 @@ class TokenCreate(TunedModel):
     user_id: str
     token: str
     expires_at: datetime
+    session_id: str | None = None
 
 class TokenAfterCreate(TokenCreate):
     id: str
@@ -42,3 +43,8 @@ class UserSalary(TunedModel):
 
 class User(UserBase, UserSalary):
     full_name: str
+
+class DiagnosticsUpdate(BaseModel):
+    enabled: bool | None = None
+    slow_ms: float | None = Field(default=None, ge=0)
+    sample_rate: float | None = Field(default=None, ge=0, le=1)
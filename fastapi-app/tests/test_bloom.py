@@ -0,0 +1,30 @@
+from hashlib import sha256
+
+from src.bloom import BloomFilter
+
+
+def key(number: int) -> bytes:
+    return sha256(str(number).encode()).digest()
+
+
+def test_bloom_filter_has_no_false_negatives() -> None:
+    bloom: BloomFilter = BloomFilter(capacity=1000, error_rate=0.01)
+    for number in range(1000):
+        bloom.add(key(number))
+    assert all(key(number) in bloom for number in range(1000))
+    assert bloom.fill_ratio == 1.0
+
+
+def test_bloom_filter_keeps_false_positive_rate_near_target() -> None:
+    bloom: BloomFilter = BloomFilter(capacity=1000, error_rate=0.01)
+    for number in range(1000):
+        bloom.add(key(number))
+    false_positives: int = sum(key(number) in bloom for number in range(1000, 11000))
+    assert false_positives < 200
+
+
+def test_bloom_filter_hashes_short_keys() -> None:
+    bloom: BloomFilter = BloomFilter(capacity=10, error_rate=0.01)
+    bloom.add(b"short")
+    assert b"short" in bloom
+    assert bloom.stats()["count"] == 1
@@ -0,0 +1,115 @@
+import asyncio
+
+import src.cache as cache
+from src.cache import MemoryCacheBackend, ReadThroughCache, TTLCache
+
+
+def test_ttl_cache_expires_entries(monkeypatch) -> None:
+    now: list[float] = [1000.0]
+    monkeypatch.setattr(cache, "time", lambda: now[0])
+    ttl_cache: TTLCache = TTLCache(max_size=10, ttl=60)
+    ttl_cache.set("token", "payload")
+    now[0] += 59
+    assert ttl_cache.get("token") == "payload"
+    now[0] += 1
+    assert ttl_cache.get("token") is None
+    assert len(ttl_cache) == 0
+    assert ttl_cache.stats()["hits"] == 1
+    assert ttl_cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_never_outlives_expires_at(monkeypatch) -> None:
+    now: list[float] = [1000.0]
+    monkeypatch.setattr(cache, "time", lambda: now[0])
+    ttl_cache: TTLCache = TTLCache(max_size=10, ttl=60)
+    ttl_cache.set("token", "payload", expires_at=1010.0)
+    now[0] += 10
+    assert ttl_cache.get("token") is None
+
+
+def test_ttl_cache_evicts_least_recently_used() -> None:
+    ttl_cache: TTLCache = TTLCache(max_size=2, ttl=60)
+    ttl_cache.set("first", 1)
+    ttl_cache.set("second", 2)
+    assert ttl_cache.get("first") == 1
+    ttl_cache.set("third", 3)
+    assert ttl_cache.get("second") is None
+    assert ttl_cache.get("first") == 1
+    assert ttl_cache.get("third") == 3
+
+
+def test_ttl_cache_disabled_with_zero_size() -> None:
+    ttl_cache: TTLCache = TTLCache(max_size=0, ttl=60)
+    ttl_cache.set("token", "payload")
+    assert ttl_cache.get("token") is None
+
+
+def read_through_cache() -> ReadThroughCache:
+    return ReadThroughCache(MemoryCacheBackend(max_size=10, ttl=60))
+
+
+def test_read_through_cache_loads_once_for_concurrent_misses() -> None:
+    async def run() -> None:
+        salary_cache: ReadThroughCache = read_through_cache()
+        loads: list[int] = []
+        release: asyncio.Event = asyncio.Event()
+
+        async def loader() -> dict:
+            loads.append(1)
+            await release.wait()
+            return { 'salary': 100 }
+
+        readers: list[asyncio.Task] = [asyncio.create_task(salary_cache.get_or_load("user", loader)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*readers) == [{ 'salary': 100 }]*5
+        assert len(loads) == 1
+        assert await salary_cache.get_or_load("user", loader) == { 'salary': 100 }
+        assert len(loads) == 1
+        assert salary_cache.stats()["hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_read_through_cache_follower_takes_over_cancelled_load() -> None:
+    async def run() -> None:
+        salary_cache: ReadThroughCache = read_through_cache()
+        loads: list[int] = []
+        release: asyncio.Event = asyncio.Event()
+
+        async def loader() -> dict:
+            loads.append(1)
+            await release.wait()
+            return { 'salary': len(loads) }
+
+        leader: asyncio.Task = asyncio.create_task(salary_cache.get_or_load("user", loader))
+        await asyncio.sleep(0)
+        follower: asyncio.Task = asyncio.create_task(salary_cache.get_or_load("user", loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == { 'salary': 2 }
+        assert leader.cancelled()
+        assert len(loads) == 2
+
+    asyncio.run(run())
+
+
+def test_read_through_cache_drops_load_invalidated_in_flight() -> None:
+    async def run() -> None:
+        salary_cache: ReadThroughCache = read_through_cache()
+        release: asyncio.Event = asyncio.Event()
+
+        async def loader() -> dict:
+            await release.wait()
+            return { 'salary': 100 }
+
+        reader: asyncio.Task = asyncio.create_task(salary_cache.get_or_load("user", loader))
+        await asyncio.sleep(0)
+        await salary_cache.invalidate("user")
+        release.set()
+        assert await reader == { 'salary': 100 }
+        assert await salary_cache.backend.get("user") is None
+
+    asyncio.run(run())
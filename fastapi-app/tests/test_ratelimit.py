@@ -0,0 +1,39 @@
+import src.ratelimit as ratelimit
+from src.ratelimit import TokenBucketLimiter, retry_after_header
+
+
+def test_token_bucket_allows_burst_then_throttles(monkeypatch) -> None:
+    now: list[float] = [100.0]
+    monkeypatch.setattr(ratelimit, "monotonic", lambda: now[0])
+    limiter: TokenBucketLimiter = TokenBucketLimiter(rate=2, burst=3, max_keys=10)
+    assert [limiter.acquire("127.0.0.1") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("127.0.0.1") == 0.5
+    now[0] += 0.5
+    assert limiter.acquire("127.0.0.1") == 0.0
+    assert limiter.stats()["allowed"] == 4
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_token_bucket_keeps_keys_apart_and_evicts_oldest(monkeypatch) -> None:
+    monkeypatch.setattr(ratelimit, "monotonic", lambda: 100.0)
+    limiter: TokenBucketLimiter = TokenBucketLimiter(rate=1, burst=1, max_keys=2)
+    assert limiter.acquire("first") == 0.0
+    assert limiter.acquire("second") == 0.0
+    assert limiter.acquire("first") == 1.0
+    assert limiter.acquire("third") == 0.0
+    assert len(limiter) == 2
+    assert limiter.stats()["evicted"] == 1
+    # the evicted key starts again with a full bucket
+    assert limiter.acquire("second") == 0.0
+
+
+def test_token_bucket_disabled_with_zero_rate() -> None:
+    limiter: TokenBucketLimiter = TokenBucketLimiter(rate=0, burst=1, max_keys=10)
+    assert all(limiter.acquire("127.0.0.1") == 0.0 for _ in range(10))
+    assert len(limiter) == 0
+
+
+def test_retry_after_header_rounds_up_to_whole_seconds() -> None:
+    assert retry_after_header(0.2) == {"Retry-After": "1"}
+    assert retry_after_header(1.5) == {"Retry-After": "2"}
+    assert retry_after_header(0.0) == {"Retry-After": "1"}
@@ -0,0 +1,16 @@
+from fastapi.testclient import TestClient
+
+import main
+from src.handlers.revocation import revocation_index
+
+
+# runs the real lifespan against an unreachable database: engines are created lazily, so every
+# startup phase except loading the revocation index has to come up without a connection
+def test_app_starts_without_database(monkeypatch) -> None:
+    async def load() -> None:
+        pass
+
+    monkeypatch.setattr(revocation_index, "load", load)
+    with TestClient(main.app) as client:
+        assert client.get("/diagnostics/status").status_code == 200
+        assert client.get("/metrics").status_code == 200
@@ -0,0 +1,39 @@
+from typing import AsyncIterator
+import asyncio
+
+from src.handlers.user_import import iter_csv_rows
+
+
+async def chunks(body: bytes, size: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(body), size):
+        yield body[start:start+size]
+
+
+def csv_rows(body: bytes, size: int) -> list[tuple[int, list[str]]]:
+    async def run() -> list[tuple[int, list[str]]]:
+        return [row async for row in iter_csv_rows(chunks(body, size))]
+
+    return asyncio.run(run())
+
+
+def test_csv_rows_keep_quoted_fields_across_lines_and_chunks() -> None:
+    body: bytes = (
+        'login,password,name\r\n'
+        'alice,"pa,ss","Alice\r\nSecond line"\r\n'
+        'bob,"say ""hi""",Bob\r\n'
+    ).encode()
+    expected: list[tuple[int, list[str]]] = [
+        (1, ['login', 'password', 'name']),
+        (2, ['alice', 'pa,ss', 'Alice\nSecond line']),
+        (4, ['bob', 'say "hi"', 'Bob'])
+    ]
+    for size in (1, 3, 7, len(body)):
+        assert csv_rows(body, size) == expected
+
+
+def test_csv_rows_return_unterminated_quote_at_end_of_body() -> None:
+    body: bytes = 'login,name\nalice,"Alice\nbob,Bob'.encode()
+    assert csv_rows(body, 4) == [
+        (1, ['login', 'name']),
+        (2, ['alice', 'Alice\nbob,Bob\n'])
+    ]